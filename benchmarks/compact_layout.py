@@ -0,0 +1,118 @@
+'''
+Compares the default and the compact database layout on a synthetic METAR corpus.
+
+For each layout the corpus is stored, then the size of the table and its indexes is measured
+and the time to read the whole corpus back through `MetarDataProvider` is taken.
+Both layouts have the same indexes, with the report included in the primary key,
+so the sizes only differ by the station dictionary and the encoding of the reports.
+The tables of both layouts are dropped and recreated, so never point this at a production database.
+
+Usage:
+```
+python -m benchmarks.compact_layout --host localhost --name benchmark --stations 200 --days 30
+```
+'''
+import argparse
+import json
+import logging
+import os
+import time
+from datetime import date, timedelta
+from typing import Dict, Optional
+
+import sqlalchemy as db
+
+from ground_data_service import (CompactMetarData, DatabaseConfig, MetarData, MetarDataProvider, Station,
+                                 drop_schema)
+
+from .environment import prepare_working_directory
+from .synthetic import generate_corpus, generate_station_ids
+
+LAYOUT_TABLES = {
+    'default': [MetarData.__table__],
+    'compact': [Station.__table__, CompactMetarData.__table__]
+}
+
+def measure_size(engine:db.engine.Engine, layout:str) -> Dict[str, Optional[int]]:
+    if engine.dialect.name != 'postgresql':
+        return {'table_bytes': None, 'index_bytes': None}
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        table_bytes = 0
+        index_bytes = 0
+        for table in LAYOUT_TABLES[layout]:
+            connection.execute(db.text(f'VACUUM ANALYZE {table.name}'))
+            sizes = connection.execute(db.text(
+                'SELECT sum(pg_table_size(relid)), sum(pg_indexes_size(relid)) FROM pg_partition_tree(:table_name)'
+            ), {'table_name': table.name}).one()
+            table_bytes += int(sizes[0])
+            index_bytes += int(sizes[1])
+    return {'table_bytes': table_bytes, 'index_bytes': index_bytes}
+
+def run_layout(database:dict, layout:str, corpus, date_from:date, date_to:date, repeats:int) -> dict:
+    prepare_working_directory({**database, 'layout': layout})
+    engine = DatabaseConfig(database).createDatabase()
+    drop_schema(engine, tables=LAYOUT_TABLES[layout][::-1])
+    provider = MetarDataProvider()
+    stations = corpus['station'].unique().tolist()
+
+    time_start = time.perf_counter()
+    provider.store_data(corpus)
+    time_store = time.perf_counter() - time_start
+
+    time_scan = []
+    for _ in range(repeats):
+        time_start = time.perf_counter()
+        data = provider.query_data(stations, date_from, date_to)
+        time_scan += [time.perf_counter() - time_start]
+    assert len(data) == len(corpus), f'Layout {layout} returned {len(data)} instead of {len(corpus)} rows'
+
+    time_dates = []
+    for _ in range(repeats):
+        time_start = time.perf_counter()
+        provider.query_dates(stations, date_from, date_to)
+        time_dates += [time.perf_counter() - time_start]
+
+    return {
+        'layout': layout,
+        'rows': len(corpus),
+        'store_seconds': time_store,
+        'query_data_seconds': min(time_scan),
+        'query_dates_seconds': min(time_dates),
+        **measure_size(engine, layout)
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares the default and the compact database layout')
+    parser.add_argument('--technology', default='postgresql')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5432)
+    parser.add_argument('--name', default='benchmark')
+    parser.add_argument('--username', default='postgres')
+    parser.add_argument('--password', default='postgres')
+    parser.add_argument('--partitioning', default='none', choices=['none', 'monthly'])
+    parser.add_argument('--stations', type=int, default=200, help='number of synthetic stations')
+    parser.add_argument('--days', type=int, default=30, help='number of days with reports per station')
+    parser.add_argument('--repeats', type=int, default=5, help='repetitions of each query, the fastest is reported')
+    parser.add_argument('--output', default=None, help='file to write the results to as JSON')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    output = os.path.abspath(args.output) if args.output is not None else None
+
+    database = {
+        'technology': args.technology, 'name': args.name, 'username': args.username,
+        'password': args.password, 'host': args.host, 'port': args.port, 'partitioning': args.partitioning,
+        'echo': False
+    }
+    date_from = date(2023, 1, 1)
+    date_to = date_from + timedelta(days=args.days)
+    corpus = generate_corpus(generate_station_ids(args.stations), date_from, args.days)
+    results = [run_layout(database, layout, corpus, date_from, date_to, args.repeats) for layout in LAYOUT_TABLES]
+    for result in results:
+        print(json.dumps(result))
+    if results[0]['table_bytes'] is not None:
+        default, compact = results
+        print(f'Table size reduced by {100.0 * (1 - compact["table_bytes"] / default["table_bytes"]):.1f} %, '
+            f'index size reduced by {100.0 * (1 - compact["index_bytes"] / default["index_bytes"]):.1f} %')
+    if output is not None:
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=4)
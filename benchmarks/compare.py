@@ -0,0 +1,46 @@
+'''
+Compares two result files of `benchmarks.suite`, e.g. of the base commit and of a change.
+
+Metrics in seconds are better when lower, metrics per second are better when higher.
+The exit code is 1 if any metric got worse by more than the threshold.
+
+Usage:
+```
+python -m benchmarks.compare baseline.json results.json --threshold 10
+```
+'''
+import argparse
+import json
+import sys
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares two result files of the benchmark suite')
+    parser.add_argument('baseline', help='results to compare against')
+    parser.add_argument('results', help='results to check for regressions')
+    parser.add_argument('--threshold', type=float, default=10.0, help='percentage by which a metric may get worse')
+    args = parser.parse_args()
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.results) as file:
+        results = json.load(file)
+    if baseline['parameters'] != results['parameters']:
+        print('Warning: the results have been measured with different parameters')
+
+    regressions = []
+    print(f'{"metric":<40} {"baseline":>14} {"results":>14} {"change":>9}')
+    for metric, value in results['metrics'].items():
+        baseline_value = baseline['metrics'].get(metric)
+        if baseline_value is None or baseline_value == 0:
+            print(f'{metric:<40} {"-":>14} {value:>14.4f} {"-":>9}')
+            continue
+        change = 100.0 * (value - baseline_value) / baseline_value
+        if metric.endswith('_seconds'):
+            worse = change > args.threshold
+        elif metric.endswith('_per_second'):
+            worse = -change > args.threshold
+        else:
+            worse = False
+        print(f'{metric:<40} {baseline_value:>14.4f} {value:>14.4f} {change:>+8.1f}%' + (' REGRESSION' if worse else ''))
+        if worse:
+            regressions += [metric]
+    sys.exit(1 if len(regressions) > 0 else 0)
@@ -0,0 +1,53 @@
+import os
+import tempfile
+from typing import Optional
+
+import yaml
+
+
+def prepare_working_directory(database:dict, server_url:Optional[str] = None, countries:Optional[str] = None,
+        storage:Optional[dict] = None) -> str:
+    '''
+    Creates a temporary working directory with its own `config.yml` and changes into it,
+    so the service reads the benchmark configuration instead of the one of the deployment.
+
+    Parameters
+    ----------
+    database: `dict`
+        The `database` section of the configuration
+    server_url: `Optional[str]`
+        The base URL of the Iowa stand-in, which replaces the Iowa server without delays between downloads
+    countries: `Optional[str]`
+        The GeoJSON of the countries that stations are mapped to
+    storage: `Optional[dict]`
+        The `storage` section of the configuration, where relative paths are placed inside the working directory
+
+    Returns
+    -------
+    `str`
+        The path of the working directory
+    '''
+    directory = tempfile.mkdtemp(prefix='ground-data-benchmark-')
+    server_url = server_url or 'http://localhost'
+    config = {
+        'metar': {
+            'download-url': f'{server_url}/cgi-bin/request/asos.py?',
+            'api-url': f'{server_url}/api/1/',
+            'data-path': os.path.join(directory, 'data', 'metar', ''),
+            'download-delay-seconds': 0.0
+        },
+        'map': {
+            'data-path': os.path.join(directory, 'data', 'map', '')
+        },
+        'database': database
+    }
+    if storage is not None:
+        config['storage'] = {**storage, 'data-path': os.path.join(directory, storage.get('data-path', 'data/parquet/'))}
+    with open(os.path.join(directory, 'config.yml'), 'w') as file:
+        yaml.safe_dump(config, file)
+    if countries is not None:
+        os.makedirs(os.path.join(directory, 'geo_data'))
+        with open(os.path.join(directory, 'geo_data', 'countries.geojson'), 'w') as file:
+            file.write(countries)
+    os.chdir(directory)
+    return directory
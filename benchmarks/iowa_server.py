@@ -0,0 +1,161 @@
+import json
+import logging
+import threading
+import time
+import zlib
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+from .synthetic import generate_metar
+
+
+class IowaStandIn:
+    '''
+    Local HTTP stand-in for the Iowa Environmental Mesonet endpoints that are used by `IowaMetarDownloader`.
+
+    It serves the `asos.py` METAR download as well as the networks and their stations.
+    All reports are generated from seeds that only depend on station and day,
+    so the same request always returns the same data.
+    '''
+
+    def __init__(self, networks:Dict[str, List[str]], interval_minutes:int = 60,
+            latency_seconds:float = 0.0, seed:int = 0) -> None:
+        '''
+        Parameters
+        ----------
+        networks: `Dict[str, List[str]]`
+            The station IDs per network ID
+        interval_minutes: `int`
+            The interval between two reports of a station
+        latency_seconds: `float`
+            The delay before each response, to simulate the remote server
+        seed: `int`
+            The seed for station positions and reports
+        '''
+        self.logger = logging.getLogger(f'{__name__}.{self.__class__.__name__}')
+        self.networks = networks
+        self.interval_minutes = interval_minutes
+        self.latency_seconds = latency_seconds
+        self.seed = seed
+        self.requests = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.__create_handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread.start()
+        self.logger.info(f'Iowa stand-in is listening on {self.url}')
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_station_positions(self) -> pd.DataFrame:
+        '''
+        Places every station at a random but fixed position on land-like latitudes.
+        '''
+        rng = np.random.default_rng(self.seed)
+        stations = [(network, station) for network, network_stations in self.networks.items() for station in network_stations]
+        positions = pd.DataFrame(stations, columns=['network', 'id'])
+        positions['longitude'] = rng.uniform(-179.0, 179.0, len(positions))
+        positions['latitude'] = rng.uniform(-60.0, 75.0, len(positions))
+        positions['elevation'] = rng.uniform(0.0, 2000.0, len(positions)).round(1)
+        return positions
+
+    def create_metar_csv(self, stations:List[str], date_from:date, date_to:date) -> str:
+        rows = []
+        day = date_from
+        while day < date_to:
+            for station in stations:
+                rng = np.random.default_rng(zlib.crc32(f'{self.seed}{station}{day}'.encode()))
+                observations = pd.date_range(pd.Timestamp(day) + pd.Timedelta(minutes=self.interval_minutes - 10),
+                    periods=24 * 60 // self.interval_minutes, freq=f'{self.interval_minutes}min')
+                rows += [(station, f'{obs:%Y-%m-%d %H:%M}', generate_metar(station, obs, rng)) for obs in observations]
+            day += timedelta(days=1)
+        return pd.DataFrame(rows, columns=['station', 'valid', 'metar']).to_csv(index=False)
+
+    def create_networks_json(self) -> str:
+        networks = pd.DataFrame({
+            'id': list(self.networks.keys()),
+            'name': [f'Synthetic network {network}' for network in self.networks]
+        })
+        return networks.to_json(orient='table', index=False)
+
+    def create_network_geojson(self, network:str) -> str:
+        positions = self.get_station_positions()
+        positions = positions[positions['network'] == network]
+        features = [{
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [row.longitude, row.latitude]},
+            'properties': {
+                'id': row.id, 'name': f'Station {row.id}', 'plot_name': f'Station {row.id}', 'network': network,
+                'country': 'XX', 'latitude': row.latitude, 'longitude': row.longitude, 'elevation': row.elevation
+            }
+        } for row in positions.itertuples()]
+        return json.dumps({'type': 'FeatureCollection', 'features': features})
+
+    def __create_handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                stand_in.requests += 1
+                time.sleep(stand_in.latency_seconds)
+                url = urlparse(self.path)
+                if url.path.endswith('/asos.py'):
+                    query = parse_qs(url.query)
+                    get_date = lambda suffix: date(int(query[f'year{suffix}'][0]),
+                        int(query[f'month{suffix}'][0]), int(query[f'day{suffix}'][0]))
+                    self.__respond(stand_in.create_metar_csv(query['station'], get_date('1'), get_date('2')), 'text/csv')
+                elif url.path.endswith('/networks.json'):
+                    self.__respond(stand_in.create_networks_json(), 'application/json')
+                elif url.path.endswith('.geojson') and url.path.split('/')[-1][:-len('.geojson')] in stand_in.networks:
+                    network = url.path.split('/')[-1][:-len('.geojson')]
+                    self.__respond(stand_in.create_network_geojson(network), 'application/geo+json')
+                else:
+                    self.send_error(404)
+
+            def __respond(self, body:str, content_type:str):
+                content = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                stand_in.logger.debug(format % args)
+
+        return Handler
+
+def create_countries_geojson(columns:int = 12, rows:int = 6) -> str:
+    '''
+    Covers the world with a grid of rectangular, synthetic countries, as replacement for `geo_data/countries.geojson`.
+    '''
+    features = []
+    width = 360.0 / columns
+    height = 180.0 / rows
+    for column in range(columns):
+        for row in range(rows):
+            west = -180.0 + column * width
+            south = -90.0 + row * height
+            index = column * rows + row
+            features += [{
+                'type': 'Feature',
+                'geometry': {'type': 'Polygon', 'coordinates': [[
+                    [west, south], [west + width, south], [west + width, south + height],
+                    [west, south + height], [west, south]
+                ]]},
+                'properties': {'ISO_A3_EH': f'C{index:02d}', 'NAME': f'Country {index}', 'CONTINENT': f'Continent {row}'}
+            }]
+    return json.dumps({'type': 'FeatureCollection', 'features': features})
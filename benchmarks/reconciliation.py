@@ -0,0 +1,116 @@
+'''
+Measures the reconciliation of downloaded data against the stored station days, which runs for every downloaded chunk.
+
+Half of the days of every station are marked as stored, the other half as missing, and a download of all days
+is reconciled with the per-station loops that were used before and with `MetarDataProvider.reconcile_download`.
+No database is touched, the METAR reports are constant as their content does not matter here.
+
+Usage:
+```
+python -m benchmarks.reconciliation --stations 1500 --days 14
+```
+'''
+import argparse
+import json
+import logging
+import os
+import time
+from datetime import date
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from ground_data_service import MetarDataProvider
+
+from .environment import prepare_working_directory
+from .synthetic import generate_station_ids
+
+
+def reconcile_per_station(data:pd.DataFrame, station_date_sets:Dict[str, np.ndarray],
+        chunk_missing_data:Dict[str, np.ndarray]) -> pd.DataFrame:
+    '''
+    The reconciliation with one full-frame mask per station, as it was done before.
+    Days are compared as `datetime64[D]`, as pandas 3 no longer matches them against python dates.
+    '''
+    for station, dates in station_date_sets.items():
+        data = data.loc[~((data['station'] == station) & (data['datetime'].dt.date.isin(dates)))]
+    none_data_to_insert = []
+    for station, dates in chunk_missing_data.items():
+        dates_df = pd.DataFrame(dates, columns=['datetime'])
+        station_days = data.loc[data['station'] == station]['datetime'].values.astype('datetime64[D]')
+        dates_df['exists'] = np.isin(dates_df['datetime'].values.astype('datetime64[D]'), station_days)
+        dates_df = dates_df.loc[~dates_df['exists']][['datetime']]
+        dates_df['station'] = station
+        dates_df['metar'] = None
+        none_data_to_insert += [dates_df]
+    return pd.concat([data] + none_data_to_insert, ignore_index=True)
+
+def create_download(stations:list, days:np.ndarray, interval_minutes:int, seed:int) -> pd.DataFrame:
+    '''
+    Creates reports for all stations and days, while every tenth station day has no reports at all.
+    '''
+    rng = np.random.default_rng(seed)
+    offsets = pd.to_timedelta(np.arange(interval_minutes - 10, 24 * 60, interval_minutes), unit='min')
+    station_days = pd.MultiIndex.from_product([stations, days], names=['station', 'day'])
+    station_days = station_days[rng.random(len(station_days)) >= 0.1]
+    data = pd.DataFrame({
+        'station': np.repeat(station_days.get_level_values('station'), len(offsets)),
+        'datetime': np.repeat(station_days.get_level_values('day'), len(offsets)) + np.tile(offsets, len(station_days))
+    })
+    data['metar'] = 'AUTO 00000KT 9999 FEW030 10/05 Q1013'
+    return data
+
+def measure(function, repeats:int) -> float:
+    durations = []
+    for _ in range(repeats):
+        time_start = time.perf_counter()
+        function()
+        durations += [time.perf_counter() - time_start]
+    return min(durations)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measures the reconciliation of downloaded data')
+    parser.add_argument('--stations', type=int, default=1500, help='number of synthetic stations')
+    parser.add_argument('--days', type=int, default=14, help='number of days per station')
+    parser.add_argument('--interval-minutes', type=int, default=60, help='interval between reports of a station')
+    parser.add_argument('--repeats', type=int, default=3, help='repetitions, the fastest is reported')
+    parser.add_argument('--skip-per-station', action='store_true', help='only measure the vectorized reconciliation')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='file to write the results to as JSON')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    output = os.path.abspath(args.output) if args.output is not None else None
+    prepare_working_directory({'technology': 'sqlite', 'name': 'reconciliation.db', 'username': '', 'password': '',
+        'host': '', 'port': 0, 'echo': False})
+    provider = MetarDataProvider()
+
+    stations = generate_station_ids(args.stations, args.seed)
+    days = np.datetime64(date(2023, 1, 1), 'D') + np.arange(args.days)
+    station_date_sets = {station: days[index % 2::2] for index, station in enumerate(stations)}
+    chunk_missing_data = {station: days[1 - index % 2::2] for index, station in enumerate(stations)}
+    data = create_download(stations, days, args.interval_minutes, args.seed)
+    coverage = provider.get_station_day_index(station_date_sets)
+    missing = provider.get_station_day_index(chunk_missing_data)
+
+    result = provider.reconcile_download(data, coverage, missing)
+    stored = pd.MultiIndex.from_arrays([result['station'], result['datetime'].values.astype('datetime64[D]')])
+    assert not stored.isin(coverage).any(), 'Stored days have not been removed'
+    assert missing.isin(stored).all(), 'Missing days are neither filled nor marked as empty'
+
+    results = {
+        'stations': args.stations,
+        'days': args.days,
+        'downloaded_rows': len(data),
+        'rows_to_store': len(result),
+        'empty_rows': int(result['metar'].isna().sum()),
+        'vectorized_seconds': measure(lambda: provider.reconcile_download(data, coverage, missing), args.repeats)
+    }
+    if not args.skip_per_station:
+        results['per_station_seconds'] = measure(
+            lambda: reconcile_per_station(data, station_date_sets, chunk_missing_data), args.repeats)
+        results['speedup'] = results['per_station_seconds'] / results['vectorized_seconds']
+    print(json.dumps(results, indent=4))
+    if output is not None:
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=4)
@@ -0,0 +1,156 @@
+'''
+Reproducible benchmark suite for the ground data service.
+
+The Iowa server is replaced by a local stand-in that serves a synthetic METAR corpus with configurable latency,
+so results only depend on the code, the database and the parameters.
+The results are written as JSON, which can be compared between commits with `benchmarks.compare`.
+
+By default the suite runs against a temporary SQLite database. When using PostgreSQL, the tables
+are dropped and recreated, so never point the suite at a production database.
+
+Usage:
+```
+python -m benchmarks.suite --properties <property> [<property> ...] --output results.json
+python -m benchmarks.suite --properties <property> --technology postgresql --host localhost --name benchmark
+python -m benchmarks.suite --properties <property> --backend parquet
+```
+'''
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from aimlsse_api.data.metar import MetarProperty
+from shapely import Polygon
+
+from ground_data_service import DatabaseConfig, MetarDataProvider, MetarMap, drop_schema
+
+from .environment import prepare_working_directory
+from .iowa_server import IowaStandIn, create_countries_geojson
+from .synthetic import generate_corpus, generate_station_ids
+
+
+def measure(function:Callable, repeats:int = 1) -> float:
+    '''
+    Runs the function repeatedly and returns the fastest duration in seconds.
+    '''
+    durations = []
+    for _ in range(repeats):
+        time_start = time.perf_counter()
+        function()
+        durations += [time.perf_counter() - time_start]
+    return min(durations)
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def create_polygons(count:int, seed:int) -> List[Polygon]:
+    rng = np.random.default_rng(seed)
+    polygons = []
+    for _ in range(count):
+        west, south = rng.uniform(-180.0, 150.0), rng.uniform(-60.0, 50.0)
+        width, height = rng.uniform(5.0, 30.0), rng.uniform(5.0, 25.0)
+        polygons += [Polygon([(west, south), (west + width, south), (west + width, south + height), (west, south + height)])]
+    return polygons
+
+def run_suite(args:argparse.Namespace, database:dict) -> Dict[str, float]:
+    metrics: Dict[str, float] = {}
+    stations = generate_station_ids(args.stations, args.seed)
+    networks = {f'N{index:02d}__ASOS': stations[index::args.networks] for index in range(args.networks)}
+    stand_in = IowaStandIn(networks, args.interval_minutes, args.latency_ms / 1000.0, args.seed)
+    stand_in.start()
+    try:
+        prepare_working_directory(database, stand_in.url, create_countries_geojson(), {'backend': args.backend})
+        engine = DatabaseConfig(database).createDatabase()
+        drop_schema(engine)
+        properties = [MetarProperty.from_string(prop_str) for prop_str in args.properties]
+
+        # Map
+        metrics['map_build_seconds'] = measure(lambda: MetarMap().force_rebuild())
+        polygons = create_polygons(args.polygons, args.seed)
+        metrics['polygon_resolution_seconds'] = measure(lambda: MetarMap().get_stations_in_polygons(polygons), args.repeats)
+
+        # Endpoint, first with an empty database and then with all data available
+        from ground_data_service.main import GroundDataService
+        service = GroundDataService()
+        query_stations = stations[:args.query_stations]
+        datetime_from = datetime(2023, 1, 1)
+        datetime_to = datetime_from + timedelta(days=args.days)
+        body = {'stations': query_stations, 'properties': args.properties}
+        run_query = lambda: asyncio.run(service.queryMetar(body, datetime_from, datetime_to))
+        requests_before = stand_in.requests
+        metrics['query_metar_cold_seconds'] = measure(run_query)
+        metrics['query_metar_cold_upstream_requests'] = stand_in.requests - requests_before
+        metrics['query_metar_warm_seconds'] = measure(run_query, args.repeats)
+
+        # Pipeline stages on a corpus outside of the queried range
+        provider = MetarDataProvider()
+        corpus_from = date(2024, 1, 1)
+        corpus = generate_corpus(query_stations, corpus_from, args.days, args.interval_minutes, args.seed)
+        metrics['ingest_rows'] = len(corpus)
+        metrics['ingest_rows_per_second'] = len(corpus) / measure(lambda: provider.store_data(corpus))
+        corpus_to = corpus_from + timedelta(days=args.days)
+        metrics['db_read_seconds'] = measure(lambda: provider.query_data(query_stations, corpus_from, corpus_to), args.repeats)
+        data = provider.query_data(query_stations, corpus_from, corpus_to)
+        _, time_decode, time_unfold = provider.decode_data(data, properties)
+        metrics['decode_rows_per_second'] = len(corpus) / time_decode
+        metrics['unfold_rows_per_second'] = len(corpus) / time_unfold
+    finally:
+        stand_in.stop()
+    return metrics
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs the benchmark suite of the ground data service')
+    parser.add_argument('--properties', nargs='+', required=True, help='property strings as accepted by /queryMetar')
+    parser.add_argument('--backend', default='database', choices=['database', 'parquet'])
+    parser.add_argument('--technology', default='sqlite', choices=['sqlite', 'postgresql'])
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5432)
+    parser.add_argument('--name', default='benchmark', help='database name, or file name for SQLite')
+    parser.add_argument('--username', default='postgres')
+    parser.add_argument('--password', default='postgres')
+    parser.add_argument('--layout', default='default', choices=['default', 'compact'])
+    parser.add_argument('--partitioning', default='none', choices=['none', 'monthly'])
+    parser.add_argument('--stations', type=int, default=500, help='number of synthetic stations')
+    parser.add_argument('--networks', type=int, default=10, help='number of networks the stations are split into')
+    parser.add_argument('--query-stations', type=int, default=50, help='number of stations per query')
+    parser.add_argument('--days', type=int, default=7, help='number of days per query')
+    parser.add_argument('--interval-minutes', type=int, default=60, help='interval between reports of a station')
+    parser.add_argument('--polygons', type=int, default=20, help='number of polygons to resolve stations for')
+    parser.add_argument('--latency-ms', type=float, default=50.0, help='latency of the Iowa stand-in')
+    parser.add_argument('--repeats', type=int, default=3, help='repetitions of warm measurements, the fastest is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--label', default=None, help='free text to identify the run')
+    parser.add_argument('--output', default=None, help='file to write the results to as JSON')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    output = os.path.abspath(args.output) if args.output is not None else None
+    if args.technology == 'sqlite':
+        args.name = args.name if args.name.endswith('.db') else f'{args.name}.db'
+
+    database = {
+        'technology': args.technology, 'name': args.name, 'username': args.username, 'password': args.password,
+        'host': args.host, 'port': args.port, 'layout': args.layout, 'partitioning': args.partitioning, 'echo': False
+    }
+    parameters = {key: value for key, value in vars(args).items() if key not in ['password', 'output']}
+    results = {
+        'label': args.label,
+        'commit': get_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'parameters': parameters,
+        'metrics': run_suite(args, database)
+    }
+    print(json.dumps(results, indent=4))
+    if output is not None:
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=4)
@@ -0,0 +1,125 @@
+import string
+from datetime import date, datetime, timedelta
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+
+def generate_station_ids(count:int, seed:int = 0) -> List[str]:
+    '''
+    Generates unique station IDs like the ones of the Iowa Environmental Mesonet.
+    Roughly half of the IDs have three letters, like stations in the US, whose reports use the ICAO ID with a leading K.
+    The other IDs are four letter ICAO IDs.
+
+    Parameters
+    ----------
+    count: `int`
+        The number of station IDs to generate
+    seed: `int`
+        The seed of the random number generator
+
+    Returns
+    -------
+    `List[str]`
+        The sorted station IDs
+    '''
+    rng = np.random.default_rng(seed)
+    letters = np.array(list(string.ascii_uppercase))
+    stations = set()
+    while len(stations) < count:
+        prefix = '' if rng.random() < 0.5 else str(rng.choice(letters))
+        stations.add(prefix + ''.join(rng.choice(letters, 3)))
+    return sorted(stations)
+
+def generate_metar(station:str, obs_datetime:datetime, rng:np.random.Generator) -> str:
+    '''
+    Generates a random but plausible METAR report, that can be parsed by the METAR library.
+
+    Parameters
+    ----------
+    station: `str`
+        The ID of the station that issues the report
+    obs_datetime: `datetime`
+        The time of the observation
+    rng: `Generator`
+        The random number generator to use
+
+    Returns
+    -------
+    `str`
+        The METAR report
+    '''
+    is_us = len(station) == 3
+    parts = ['K' + station if is_us else station, f'{obs_datetime:%d%H%M}Z']
+    if rng.random() < 0.3:
+        parts += ['AUTO']
+    wind_speed = int(rng.integers(0, 25))
+    wind = f'{int(rng.integers(0, 36)) * 10:03d}{wind_speed:02d}'
+    if wind_speed > 12 and rng.random() < 0.3:
+        wind += f'G{wind_speed + int(rng.integers(8, 20)):02d}'
+    parts += [wind + 'KT']
+    weather = str(rng.choice(['', '', '', '', '-RA', 'RA', 'BR', '-SN', 'FG', 'TSRA']))
+    if weather == 'FG':
+        parts += ['1/4SM' if is_us else '0300']
+    elif weather == '':
+        parts += ['10SM' if is_us else '9999']
+    else:
+        parts += [f'{int(rng.integers(2, 9))}SM' if is_us else f'{int(rng.integers(20, 80)) * 100:04d}']
+    if weather != '':
+        parts += [weather]
+    layers = int(rng.integers(0, 4))
+    if layers == 0:
+        parts += ['CLR' if is_us else 'NSC']
+    else:
+        heights = np.sort(rng.integers(3, 250, layers))
+        covers = rng.choice(['FEW', 'SCT', 'BKN', 'OVC'], layers)
+        parts += [f'{cover}{height:03d}' for cover, height in zip(covers, heights)]
+    temperature = int(rng.integers(-20, 36))
+    dew_point = temperature - int(rng.integers(0, 12))
+    format_temperature = lambda value: f'M{-value:02d}' if value < 0 else f'{value:02d}'
+    parts += [f'{format_temperature(temperature)}/{format_temperature(dew_point)}']
+    pressure = int(rng.integers(980, 1040))
+    if is_us:
+        parts += [f'A{round(pressure * 2.953):04d}', 'RMK', 'AO2', f'SLP{pressure * 10 % 1000:03d}']
+        if weather.endswith('RA'):
+            parts += [f'P{int(rng.integers(1, 30)):04d}']
+        format_tenths = lambda value: f'{1 if value < 0 else 0}{abs(value) * 10:03d}'
+        parts += [f'T{format_tenths(temperature)}{format_tenths(dew_point)}']
+    else:
+        parts += [f'Q{pressure:04d}', 'NOSIG']
+    return ' '.join(parts)
+
+def generate_corpus(stations:List[str], date_from:date, days:int,
+        interval_minutes:int = 60, seed:int = 0) -> pd.DataFrame:
+    '''
+    Generates a METAR report for every station and interval in the given range of days.
+    Every report is observed at ten minutes before the full interval, like routine METAR reports.
+
+    Parameters
+    ----------
+    stations: `List[str]`
+        The stations that issue reports
+    date_from: `date`
+        The first day to generate reports for
+    days: `int`
+        The number of days to generate reports for
+    interval_minutes: `int`
+        The interval between two reports of a station
+    seed: `int`
+        The seed of the random number generator
+
+    Returns
+    -------
+    `DataFrame`
+        The reports with the columns `station`, `datetime` and `metar`, in the format of the Iowa downloads
+    '''
+    rng = np.random.default_rng(seed)
+    start = datetime(date_from.year, date_from.month, date_from.day) + timedelta(minutes=interval_minutes - 10)
+    observations = pd.date_range(start, periods=days * 24 * 60 // interval_minutes, freq=f'{interval_minutes}min')
+    rows = [
+        (station, obs_datetime, generate_metar(station, obs_datetime, rng))
+        for station in stations
+        for obs_datetime in observations
+    ]
+    return pd.DataFrame(rows, columns=['station', 'datetime', 'metar'])
@@ -1,6 +1,15 @@
 from .date_util import DateRange, DateChunker, get_days_between_ranges, get_days_overlap
 from .properties import MetarWrapper
+from .tracing import DebugSampler, Trace, TracingConfig, current_trace, debug_sampled, sample_debug, span
+from .metrics import (count_cache_lookups, count_parse_failures, count_rows, count_upstream_response,
+                      current_endpoint, observe_phase)
 from .iowa import IowaMetarDownloader
 from .map import MetarMap
 from .station import StationControl
-from .metar import MetarDataProvider
\ No newline at end of file
+from .database import (Base, CompactMetarData, DatabaseConfig, MetarData, MetarIngest, MetarPartitioner, Station,
+                       create_schema, drop_schema, iterate_months, prepare_schema)
+from .storage import DatabaseMetarStore, IngestLog, MetarStore, StorageConfig
+from .compact import CompactMetarStore, MetarCodec, StationDictionary
+from .parquet import ParquetMetarStore
+from .aggregation import MetarAggregator
+from .metar import MetarDataProvider, MetarQuery
\ No newline at end of file
@@ -0,0 +1,107 @@
+import logging
+from typing import Dict, List, Optional
+
+import pandas as pd
+from aimlsse_api.data.metar import *
+
+default_aggregations: Dict[MetarPropertyType, List[str]] = {
+    MetarPropertyType.TEMPERATURE       : ['mean', 'min', 'max'],
+    MetarPropertyType.DEW_POINT         : ['mean', 'min', 'max'],
+    MetarPropertyType.WIND_SPEED        : ['mean', 'max'],
+    MetarPropertyType.WIND_GUST_SPEED   : ['max'],
+    MetarPropertyType.WIND_SPEED_PEAK   : ['max'],
+    MetarPropertyType.VISIBILITY        : ['min'],
+    MetarPropertyType.PRECIPITATION_1H  : ['sum'],
+    MetarPropertyType.PRECIPITATION_3H  : ['sum'],
+    MetarPropertyType.PRECIPITATION_6H  : ['sum'],
+    MetarPropertyType.PRECIPITATION_24H : ['sum'],
+    MetarPropertyType.SNOW_DEPTH        : ['max']
+}
+'''
+Maps the METAR properties to the statistics that are computed when none are requested explicitly.
+All other properties default to the mean.
+'''
+
+aggregation_functions = ['mean', 'median', 'min', 'max', 'sum', 'count', 'first', 'last']
+'''
+The statistics that can be requested for each property
+'''
+
+class MetarAggregator:
+    '''
+    Resamples decoded METAR data per station into statistics over fixed time intervals.
+    '''
+
+    def __init__(self) -> None:
+        self.logger = logging.getLogger(f'{__name__}.{self.__class__.__name__}')
+
+    def get_aggregations(self, properties:List[MetarProperty],
+            aggregations:Optional[Dict[str, List[str]]] = None) -> Dict[str, List[str]]:
+        '''
+        Determines which statistics are computed for each of the properties.
+
+        Parameters
+        ----------
+        properties: `List[MetarProperty]`
+            The properties to aggregate
+        aggregations: `Optional[Dict[str, List[str]]]`
+            The statistics per property name, which override the defaults
+
+        Raises
+        ------
+        `ValueError`
+            If a property can not be aggregated or a statistic is not known
+
+        Returns
+        -------
+        `Dict[str, List[str]]`
+            The statistics per property name
+        '''
+        aggregations = aggregations or {}
+        result: Dict[str, List[str]] = {}
+        for property in properties:
+            if property.type.has_multiple_entries() or property.type.uses_multiple_values():
+                raise ValueError(f'Property {property} has multiple values and can not be aggregated')
+            property_name = str(property)
+            functions = aggregations.get(property_name, default_aggregations.get(property.type, ['mean']))
+            unknown_functions = [function for function in functions if function not in aggregation_functions]
+            if len(unknown_functions) > 0:
+                raise ValueError(f'Statistics {unknown_functions} are not known, use any of {aggregation_functions}')
+            result[property_name] = functions
+        unknown_properties = [name for name in aggregations if name not in result]
+        if len(unknown_properties) > 0:
+            raise ValueError(f'Statistics are requested for properties {unknown_properties} that are not queried')
+        return result
+
+    def aggregate(self, data:pd.DataFrame, aggregations:Dict[str, List[str]], frequency:str) -> pd.DataFrame:
+        '''
+        Computes the statistics of the properties per station and time interval.
+
+        Parameters
+        ----------
+        data: `DataFrame`
+            The decoded METAR data with the columns `station`, `datetime` and one column per property
+        aggregations: `Dict[str, List[str]]`
+            The statistics per property name, as returned by `get_aggregations`
+        frequency: `str`
+            The length of the time intervals as pandas offset alias, like `1h` or `1D`
+
+        Returns
+        -------
+        `DataFrame`
+            One row per station and interval that contains observations,
+            with the columns `station`, `datetime`, `observations` and one column per property and statistic
+        '''
+        statistic_names = [f'{name}_{function}' for name, functions in aggregations.items() for function in functions]
+        if data.empty:
+            return pd.DataFrame(columns=['station', 'datetime', 'observations'] + statistic_names)
+        values = data[list(aggregations.keys())].apply(pd.to_numeric, errors='coerce')
+        values['station'] = data['station']
+        values['datetime'] = pd.to_datetime(data['datetime'])
+        grouped = values.groupby(['station', pd.Grouper(key='datetime', freq=frequency)])
+        result = grouped.agg(aggregations)
+        result.columns = statistic_names
+        result.insert(0, 'observations', grouped.size())
+        result.reset_index(inplace=True)
+        self.logger.info(f'Aggregated {len(data)} observations into {len(result)} intervals')
+        return result
@@ -0,0 +1,299 @@
+import logging
+import zlib
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as db
+import sqlalchemy.orm as orm
+from sqlalchemy.dialects import postgresql, sqlite
+
+from . import CompactMetarData, IngestLog, MetarPartitioner, MetarStore, Station
+
+METAR_DICTIONARY = (
+    b' -RA -SN -DZ BR HZ FG RA SN TS CB TCU CLR SKC NSC NCD VV00 FEW0 SCT0 BKN0 OVC0'
+    b' BECMG TEMPO NOSIG CAVOK 9999 VRB0 00000KT KT G1 G2 SM 10SM M0 A29 A30 Q09 Q10'
+    b' RMK AO2 SLP T0 T1 10 20 AUTO '
+)
+'''
+Preset dictionary with common METAR tokens for the compression of single reports.
+Most common tokens are located at the end, as the compressor prefers short distances.
+The dictionary must never change, as stored reports can only be decompressed with the exact same dictionary.
+'''
+
+class MetarCodec:
+    '''
+    Encodes METAR reports for the compact layout.
+
+    The station ID and time at the start of a report are already stored in their own columns,
+    so they are stripped from the report if they match.
+    Reports may name the station differently than the station ID, like `KDSM` for the US station `DSM`.
+    Then the ID of the report is kept in front of the body, which is still shorter than the full prefix.
+    The remaining body is compressed using the `METAR_DICTIONARY`, if that makes it shorter.
+    The first byte of the encoded report holds flags that describe which of these steps were applied.
+    '''
+    FLAG_PREFIX_STRIPPED = 0x01
+    FLAG_COMPRESSED = 0x02
+    FLAG_REPORT_ID = 0x04
+
+    def get_prefix(self, station:str, obs_datetime:datetime) -> str:
+        return f'{station} {obs_datetime:%d%H%M}Z '
+
+    def encode(self, station:str, obs_datetime:datetime, metar:Optional[str]) -> Optional[bytes]:
+        '''
+        Encodes a METAR report.
+
+        Parameters
+        ----------
+        station: `str`
+            The ID of the station that issued the report
+        obs_datetime: `datetime`
+            The time of the observation
+        metar: `Optional[str]`
+            The report to encode, or None if there is no report
+
+        Returns
+        -------
+        `Optional[bytes]`
+            The encoded report, or None if there is no report
+        '''
+        if metar is None or pd.isna(metar):
+            return None
+        flags = 0
+        report_id = b''
+        first_token = metar.split(' ', 1)[0]
+        prefix = self.get_prefix(first_token, obs_datetime)
+        if metar.startswith(prefix) and len(first_token.encode('utf-8')) < 256:
+            metar = metar[len(prefix):]
+            flags |= MetarCodec.FLAG_PREFIX_STRIPPED
+            if first_token != station:
+                report_id = first_token.encode('utf-8')
+                report_id = bytes([len(report_id)]) + report_id
+                flags |= MetarCodec.FLAG_REPORT_ID
+        body = metar.encode('utf-8')
+        compressor = zlib.compressobj(level=9, wbits=-zlib.MAX_WBITS, zdict=METAR_DICTIONARY)
+        compressed_body = compressor.compress(body) + compressor.flush()
+        if len(compressed_body) < len(body):
+            body = compressed_body
+            flags |= MetarCodec.FLAG_COMPRESSED
+        return bytes([flags]) + report_id + body
+
+    def decode(self, station:str, obs_datetime:datetime, payload:Optional[bytes]) -> Optional[str]:
+        '''
+        Decodes a METAR report that has been encoded with `encode`.
+
+        Parameters
+        ----------
+        station: `str`
+            The ID of the station that issued the report
+        obs_datetime: `datetime`
+            The time of the observation
+        payload: `Optional[bytes]`
+            The encoded report, or None if there is no report
+
+        Returns
+        -------
+        `Optional[str]`
+            The original report, or None if there is no report
+        '''
+        if payload is None:
+            return None
+        flags = payload[0]
+        body = bytes(payload[1:])
+        report_id = station
+        if flags & MetarCodec.FLAG_REPORT_ID:
+            report_id = body[1:1 + body[0]].decode('utf-8')
+            body = body[1 + body[0]:]
+        if flags & MetarCodec.FLAG_COMPRESSED:
+            decompressor = zlib.decompressobj(wbits=-zlib.MAX_WBITS, zdict=METAR_DICTIONARY)
+            body = decompressor.decompress(body) + decompressor.flush()
+        metar = body.decode('utf-8')
+        if flags & MetarCodec.FLAG_PREFIX_STRIPPED:
+            metar = self.get_prefix(report_id, obs_datetime) + metar
+        return metar
+
+class StationDictionary:
+    '''
+    Maps station IDs to the small integer keys of the `stations` table.
+    Keys are cached per instance, as they belong to the database of its engine.
+    '''
+
+    def __init__(self, engine:db.engine.Engine) -> None:
+        self.logger = logging.getLogger(f'{__name__}.{self.__class__.__name__}')
+        self.engine = engine
+        self.station_to_id: Dict[str, int] = {}
+
+    def get_ids(self, stations:List[str], create:bool = False) -> Dict[str, int]:
+        '''
+        Looks up the keys of the given stations.
+
+        Parameters
+        ----------
+        stations: `List[str]`
+            The station IDs to look up
+        create: `bool`
+            Whether stations without a key are added to the dictionary
+
+        Returns
+        -------
+        `Dict[str, int]`
+            The keys of all stations that are part of the dictionary
+        '''
+        unknown_stations = [station for station in set(stations) if station not in self.station_to_id]
+        if len(unknown_stations) > 0:
+            self.__load(unknown_stations)
+            missing_stations = [station for station in unknown_stations if station not in self.station_to_id]
+            if create and len(missing_stations) > 0:
+                self.logger.info(f'Adding {len(missing_stations)} stations to the dictionary..')
+                self.__insert(missing_stations)
+                self.__load(missing_stations)
+                unresolved_stations = [station for station in missing_stations if station not in self.station_to_id]
+                if len(unresolved_stations) > 0:
+                    raise ValueError(f'Stations {unresolved_stations} could not be added to the dictionary')
+        return {station: self.station_to_id[station]
+            for station in stations if station in self.station_to_id}
+
+    def get_stations(self, ids:List[int]) -> Dict[int, str]:
+        '''
+        Looks up the station IDs of the given keys, which must have been returned by `get_ids` before.
+        '''
+        id_to_station = {key: station for station, key in self.station_to_id.items()}
+        return {key: id_to_station[key] for key in ids}
+
+    def __insert(self, stations:List[str]):
+        '''
+        Adds the stations to the table, skipping stations that have been added concurrently by another process.
+        '''
+        rows = [{'station': station} for station in stations]
+        if self.engine.dialect.name in ['postgresql', 'sqlite']:
+            insert = postgresql.insert if self.engine.dialect.name == 'postgresql' else sqlite.insert
+            with self.engine.begin() as connection:
+                connection.execute(insert(Station).on_conflict_do_nothing(index_elements=['station']), rows)
+            return
+        # Without ON CONFLICT, each station is inserted on its own, so a conflict does not discard the others
+        for row in rows:
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(db.insert(Station), row)
+            except db.exc.IntegrityError:
+                self.logger.info(f'Station {row["station"]} has already been added to the dictionary')
+
+    def __load(self, stations:List[str]):
+        with self.engine.connect() as connection:
+            stmt = db.select(Station.station, Station.id).where(Station.station.in_(stations))
+            self.station_to_id.update(connection.execute(stmt).tuples().all())
+
+class CompactMetarStore(MetarStore):
+    '''
+    Stores and queries METAR data in the compact layout.
+
+    The data is accepted and returned in the same format as for the default layout,
+    so the layout is transparent to the users of `MetarDataProvider`.
+    '''
+
+    def __init__(self, engine:db.engine.Engine, partitioner:Optional[MetarPartitioner] = None) -> None:
+        self.logger = logging.getLogger(f'{__name__}.{self.__class__.__name__}')
+        self.engine = engine
+        self.partitioner = partitioner
+        self.codec = MetarCodec()
+        self.station_dictionary = StationDictionary(engine)
+        self.ingest_log = IngestLog(engine)
+
+    def store_data(self, data:pd.DataFrame, ingested_at:datetime):
+        if data.empty:
+            return
+        with self.ingest_log.track(ingested_at):
+            if self.partitioner is not None:
+                self.partitioner.ensure_partitions(data['datetime'].min(), data['datetime'].max())
+            station_ids = self.station_dictionary.get_ids(data['station'].unique().tolist(), create=True)
+            metar_data = [
+                {
+                    'datetime': pd.Timestamp(obs_datetime).to_pydatetime(),
+                    'station_id': station_ids[station],
+                    'metar': self.codec.encode(station, obs_datetime, metar),
+                    'ingested_at': ingested_at
+                }
+                for station, obs_datetime, metar in zip(data['station'], data['datetime'], data['metar'])
+            ]
+            with orm.Session(self.engine) as session:
+                session.execute(db.insert(CompactMetarData), metar_data)
+                session.commit()
+        self.logger.info(f'Stored {len(metar_data)} rows in compact layout')
+
+    def query_data(self, stations:List[str], datetime_from:datetime, datetime_to:datetime) -> pd.DataFrame:
+        station_ids = self.station_dictionary.get_ids(stations)
+        with orm.Session(self.engine) as session:
+            stmt = (
+                db.select(CompactMetarData.station_id, CompactMetarData.datetime, CompactMetarData.metar)
+                .where(CompactMetarData.station_id.in_(station_ids.values()))
+                .where(CompactMetarData.datetime >= datetime_from)
+                .where(CompactMetarData.datetime < datetime_to)
+                .order_by(db.asc(CompactMetarData.station_id), db.asc(CompactMetarData.datetime))
+            )
+            rows = session.execute(stmt).all()
+        id_to_station = self.station_dictionary.get_stations(list(station_ids.values()))
+        result = pd.DataFrame([
+            (id_to_station[station_id], obs_datetime, self.codec.decode(id_to_station[station_id], obs_datetime, payload))
+            for station_id, obs_datetime, payload in rows
+        ], columns=['station', 'datetime', 'metar'])
+        # Keep the order of the default layout, which sorts by station ID instead of key
+        return result.sort_values(['station', 'datetime'], ignore_index=True)
+
+    def query_changed_data(self, since:Optional[datetime], until:datetime,
+            stations:Optional[List[str]] = None) -> pd.DataFrame:
+        with orm.Session(self.engine) as session:
+            stmt = (
+                db.select(Station.station, CompactMetarData.datetime, CompactMetarData.metar, CompactMetarData.ingested_at)
+                .join(Station, Station.id == CompactMetarData.station_id)
+                .where(CompactMetarData.metar.is_not(None))
+                .order_by(db.asc(CompactMetarData.ingested_at), db.asc(Station.station), db.asc(CompactMetarData.datetime))
+            )
+            if since is None:
+                stmt = stmt.where(db.or_(CompactMetarData.ingested_at.is_(None), CompactMetarData.ingested_at <= until))
+            else:
+                stmt = stmt.where(CompactMetarData.ingested_at > since).where(CompactMetarData.ingested_at <= until)
+            if stations is not None:
+                stmt = stmt.where(Station.station.in_(stations))
+            rows = session.execute(stmt).all()
+        return pd.DataFrame([
+            (station, obs_datetime, self.codec.decode(station, obs_datetime, payload), ingested_at)
+            for station, obs_datetime, payload, ingested_at in rows
+        ], columns=['station', 'datetime', 'metar', 'ingested_at'])
+
+    def query_ingest_sizes(self, since:Optional[datetime], until:datetime,
+            stations:Optional[List[str]] = None) -> pd.DataFrame:
+        with orm.Session(self.engine) as session:
+            stmt = (
+                db.select(CompactMetarData.ingested_at, db.func.count())
+                .where(CompactMetarData.metar.is_not(None))
+                .group_by(CompactMetarData.ingested_at)
+                .order_by(CompactMetarData.ingested_at.asc().nulls_first())
+            )
+            if since is None:
+                stmt = stmt.where(db.or_(CompactMetarData.ingested_at.is_(None), CompactMetarData.ingested_at <= until))
+            else:
+                stmt = stmt.where(CompactMetarData.ingested_at > since).where(CompactMetarData.ingested_at <= until)
+            if stations is not None:
+                stmt = stmt.where(CompactMetarData.station_id.in_(self.station_dictionary.get_ids(stations).values()))
+            return pd.DataFrame(session.execute(stmt).all(), columns=['ingested_at', 'rows'])
+
+    def query_dates(self, stations:List[str], date_from:date, date_to:date) -> Dict[str, np.ndarray[np.datetime64]]:
+        station_ids = self.station_dictionary.get_ids(stations)
+        with orm.Session(self.engine) as session:
+            stmt = (
+                db.select(CompactMetarData.station_id, CompactMetarData.datetime)
+                .where(CompactMetarData.station_id.in_(station_ids.values()))
+                .where(CompactMetarData.datetime >= date_from)
+                .where(CompactMetarData.datetime < date_to)
+            )
+            rows = session.execute(stmt).all()
+        id_to_station = self.station_dictionary.get_stations(list(station_ids.values()))
+        dates = pd.DataFrame(rows, columns=['station_id', 'datetime'])
+        result: Dict[str, np.ndarray[np.datetime64]] = {station: np.array([], dtype='datetime64[D]') for station in stations}
+        for station_id, station_datetimes in dates.groupby('station_id')['datetime']:
+            result[id_to_station[station_id]] = np.unique(station_datetimes.values.astype('datetime64[D]'))
+        return result
+
+    def get_oldest_ingest(self, now:datetime) -> Optional[datetime]:
+        return self.ingest_log.get_oldest(now)
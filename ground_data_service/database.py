@@ -0,0 +1,284 @@
+import logging
+from datetime import date, datetime
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import sqlalchemy as db
+import sqlalchemy.orm as orm
+
+
+class DatabaseConfig:
+
+    def __init__(self, config:dict) -> None:
+        self.technology     = config['technology']
+        self.name           = config['name']
+        self.username       = config['username']
+        self.password       = config['password']
+        self.host           = config['host']
+        self.port           = config['port']
+        self.partitioning   = config.get('partitioning', 'none')
+        self.layout         = config.get('layout', 'default')
+        self.echo           = config.get('echo', False)
+
+    def createDatabase(self) -> db.engine.Engine:
+        if self.technology == 'sqlite':
+            # SQLite is file-based, the name is the path of the database file
+            return db.create_engine(f'sqlite:///{self.name}', echo=self.echo)
+        return db.create_engine(f'{self.technology}://{self.username}:{self.password}@{self.host}:{self.port}/{self.name}', echo=self.echo)
+
+class Base(orm.DeclarativeBase):
+    pass
+
+class MetarData(Base):
+    __tablename__ = 'metar_data'
+    __table_args__ = (
+        # Rows arrive roughly in time order, so a BRIN index stays tiny while still skipping most blocks on time ranges
+        db.Index('ix_metar_data_datetime_brin', 'datetime', postgresql_using='brin').ddl_if(dialect='postgresql'),
+        # Including the report allows index-only scans for station + time range queries, without a second B-tree
+        db.PrimaryKeyConstraint('station', 'datetime', postgresql_include=['metar']),
+        # Serves the change feed, so incremental syncs only touch new rows
+        db.Index('ix_metar_data_ingested_at', 'ingested_at'),
+    )
+
+    station = orm.mapped_column(db.String, nullable=False)
+    datetime = orm.mapped_column(db.DateTime, nullable=False)
+    metar = orm.mapped_column(db.String)
+    # Time of storage in UTC, shared by all rows that are stored together - rows from before the change feed have none
+    ingested_at = orm.mapped_column(db.DateTime, nullable=True)
+
+    def __repr__(self) -> str:
+        return f'MetarData(station={self.station!r}, datetime={self.datetime!r}, metar={self.metar!r})'
+
+class Station(Base):
+    '''
+    Dictionary of station IDs, so the compact layout only has to store a small integer per observation.
+    '''
+    __tablename__ = 'stations'
+
+    # SQLite only generates keys for columns declared as INTEGER PRIMARY KEY
+    id = orm.mapped_column(db.SmallInteger().with_variant(db.Integer, 'sqlite'), db.Identity(), primary_key=True)
+    station = orm.mapped_column(db.String, unique=True, nullable=False)
+
+    def __repr__(self) -> str:
+        return f'Station(id={self.id!r}, station={self.station!r})'
+
+class CompactMetarData(Base):
+    '''
+    Compact alternative to `MetarData`, where the station is referenced by its dictionary ID
+    and the report is stored without its redundant prefix and compressed.
+    '''
+    __tablename__ = 'metar_data_compact'
+    __table_args__ = (
+        # Same index structure as the default layout, so both allow index-only scans
+        db.PrimaryKeyConstraint('station_id', 'datetime', postgresql_include=['metar']),
+        db.Index('ix_metar_data_compact_datetime_brin', 'datetime', postgresql_using='brin').ddl_if(dialect='postgresql'),
+        db.Index('ix_metar_data_compact_ingested_at', 'ingested_at'),
+    )
+
+    # Fixed-width columns first to avoid alignment padding in the rows
+    datetime = orm.mapped_column(db.DateTime, nullable=False)
+    station_id = orm.mapped_column(db.SmallInteger().with_variant(db.Integer, 'sqlite'), db.ForeignKey(Station.id), nullable=False)
+    metar = orm.mapped_column(db.LargeBinary)
+    ingested_at = orm.mapped_column(db.DateTime, nullable=True)
+
+    def __repr__(self) -> str:
+        return f'CompactMetarData(station_id={self.station_id!r}, datetime={self.datetime!r}, metar={self.metar!r})'
+
+class MetarIngest(Base):
+    '''
+    Ingests that are still in progress, so the change feed does not issue a watermark past rows that are not committed yet.
+    '''
+    __tablename__ = 'metar_ingests'
+
+    id = orm.mapped_column(db.Integer, primary_key=True)
+    # Same time as the ingested_at of the rows that are stored by the ingest
+    started_at = orm.mapped_column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self) -> str:
+        return f'MetarIngest(id={self.id!r}, started_at={self.started_at!r})'
+
+def iterate_months(datetime_from:date, datetime_to:date) -> Iterator[Tuple[date, date]]:
+    '''
+    Yields the half-open month intervals `[start, end)` that cover the given closed date-range.
+
+    Parameters
+    ----------
+    datetime_from: `date`
+        The first date or datetime to cover
+    datetime_to: `date`
+        The last date or datetime to cover
+
+    Returns
+    -------
+    `Iterator[Tuple[date, date]]`
+        The first day of each month together with the first day of the following month
+    '''
+    month_start = date(datetime_from.year, datetime_from.month, 1)
+    while month_start <= (datetime_to.date() if isinstance(datetime_to, datetime) else datetime_to):
+        if month_start.month == 12:
+            month_end = date(month_start.year + 1, 1, 1)
+        else:
+            month_end = date(month_start.year, month_start.month + 1, 1)
+        yield month_start, month_end
+        month_start = month_end
+
+class MetarPartitioner:
+    '''
+    Manages the monthly range partitions of a METAR data table on PostgreSQL.
+
+    Partitions are created on demand before data is stored, so the table never needs a default partition.
+    The partitions that are known to exist are remembered per instance, as they belong to the database of its engine.
+    '''
+
+    def __init__(self, engine:db.engine.Engine, table_name:str = MetarData.__tablename__) -> None:
+        self.logger = logging.getLogger(f'{__name__}.{self.__class__.__name__}')
+        self.engine = engine
+        self.table_name = table_name
+        self.known_partitions: Set[str] = set()
+
+    def get_partition_name(self, month_start:date) -> str:
+        return f'{self.table_name}_y{month_start.year:04d}m{month_start.month:02d}'
+
+    def is_partitioned(self) -> bool:
+        '''
+        Checks whether the table exists as a partitioned table.
+        '''
+        stmt = db.text(
+            'SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid '
+            'WHERE c.relname = :table_name AND pg_table_is_visible(c.oid)'
+        )
+        with self.engine.connect() as connection:
+            return connection.execute(stmt, {'table_name': self.table_name}).first() is not None
+
+    def ensure_partitions(self, datetime_from:date, datetime_to:date):
+        '''
+        Creates all monthly partitions required to store data in the given closed date-range.
+
+        Parameters
+        ----------
+        datetime_from: `date`
+            The earliest date or datetime that will be stored
+        datetime_to: `date`
+            The latest date or datetime that will be stored
+        '''
+        missing_partitions = [
+            (self.get_partition_name(month_start), month_start, month_end)
+            for month_start, month_end in iterate_months(datetime_from, datetime_to)
+            if self.get_partition_name(month_start) not in self.known_partitions
+        ]
+        if len(missing_partitions) == 0:
+            return
+        with self.engine.begin() as connection:
+            for partition_name, month_start, month_end in missing_partitions:
+                self.logger.info(f'Ensuring partition {partition_name} exists..')
+                connection.execute(db.text(
+                    f'CREATE TABLE IF NOT EXISTS {partition_name} PARTITION OF {self.table_name} '
+                    f"FOR VALUES FROM ('{month_start.isoformat()}') TO ('{month_end.isoformat()}')"
+                ))
+        self.known_partitions.update(partition_name for partition_name, _, _ in missing_partitions)
+
+def upgrade_schema(engine:db.engine.Engine, table:db.Table):
+    '''
+    Adds the columns and indexes to an existing table, that have been introduced after the table was created.
+
+    Parameters
+    ----------
+    engine: `Engine`
+        The engine to upgrade the schema with
+    table: `Table`
+        The table to upgrade
+    '''
+    logger = logging.getLogger(f'{__name__}.upgrade_schema')
+    existing_columns = [column['name'] for column in db.inspect(engine).get_columns(table.name)]
+    if 'ingested_at' not in existing_columns:
+        logger.info(f'Adding column ingested_at to table {table.name}..')
+        with engine.begin() as connection:
+            connection.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN ingested_at TIMESTAMP'))
+    # The primary key can not be changed this way, it only includes the reports after the partitioning migration
+    for index in table.indexes:
+        index.create(engine, checkfirst=True)
+
+prepared_schemas: Dict[Tuple[str, str, str], Optional[MetarPartitioner]] = {}
+'''
+Results of `create_schema` per database, layout and partitioning, so the schema is only prepared once per process
+'''
+
+def get_database_key(engine:db.engine.Engine) -> str:
+    return engine.url.render_as_string(hide_password=False)
+
+def create_schema(engine:db.engine.Engine, db_config:DatabaseConfig) -> Optional[MetarPartitioner]:
+    '''
+    Creates all tables and indexes that do not exist yet.
+    This is done once per process and database, later calls return the result of the first one.
+    Tables that are changed by other processes, like the migration, are only detected after a restart.
+
+    Depending on the configured layout, either `metar_data` or the `stations` dictionary
+    together with `metar_data_compact` are created.
+    When monthly partitioning is configured and the database is PostgreSQL,
+    the METAR data table is created as a table partitioned by range on its datetime.
+
+    Parameters
+    ----------
+    engine: `Engine`
+        The engine to create the schema with
+    db_config: `DatabaseConfig`
+        The configuration that decides about layout and partitioning
+
+    Returns
+    -------
+    `Optional[MetarPartitioner]`
+        The partitioner that has to be used before storing data, or None if the table is not partitioned.
+        An existing partitioned table always gets a partitioner, regardless of the configuration
+    '''
+    key = (get_database_key(engine), db_config.layout, db_config.partitioning)
+    if key not in prepared_schemas:
+        prepared_schemas[key] = prepare_schema(engine, db_config)
+    return prepared_schemas[key]
+
+def drop_schema(engine:db.engine.Engine, tables:Optional[List[db.Table]] = None):
+    '''
+    Drops the tables, all of them by default, and forgets that the schema of the database has been prepared.
+
+    Parameters
+    ----------
+    engine: `Engine`
+        The engine to drop the tables with
+    tables: `Optional[List[Table]]`
+        The tables to drop, or None to drop all tables
+    '''
+    Base.metadata.drop_all(engine, tables=tables)
+    database_key = get_database_key(engine)
+    for key in [key for key in prepared_schemas if key[0] == database_key]:
+        del prepared_schemas[key]
+
+def prepare_schema(engine:db.engine.Engine, db_config:DatabaseConfig) -> Optional[MetarPartitioner]:
+    '''
+    Creates the schema like `create_schema`, but every time it is called.
+    '''
+    logger = logging.getLogger(f'{__name__}.prepare_schema')
+    use_partitioning = db_config.partitioning == 'monthly'
+    if use_partitioning and engine.dialect.name != 'postgresql':
+        logger.warning(f'Partitioning is only supported on PostgreSQL, not on {engine.dialect.name} - ignoring')
+        use_partitioning = False
+    if db_config.layout == 'compact':
+        tables = [MetarIngest.__table__, Station.__table__, CompactMetarData.__table__]
+    elif db_config.layout == 'default':
+        tables = [MetarIngest.__table__, MetarData.__table__]
+    else:
+        raise ValueError(f'Database layout {db_config.layout} is not known')
+    data_table = tables[-1]
+    if use_partitioning:
+        data_table.dialect_kwargs['postgresql_partition_by'] = 'RANGE (datetime)'
+    Base.metadata.create_all(engine, tables=tables)
+    upgrade_schema(engine, data_table)
+    if engine.dialect.name != 'postgresql':
+        return None
+    # The existing table decides, as it may have been migrated while the configuration still says otherwise
+    partitioner = MetarPartitioner(engine, data_table.name)
+    if partitioner.is_partitioned():
+        if not use_partitioning:
+            logger.info(f'Table {data_table.name} is partitioned, partitions are created although partitioning is disabled')
+        return partitioner
+    if use_partitioning:
+        logger.warning(f'Table {data_table.name} is not partitioned yet, '
+            'run "python -m ground_data_service.migrate" to move it into the partitioned layout')
+    return None
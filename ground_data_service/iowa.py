@@ -13,6 +13,8 @@ import requests
 import yaml
 import json
 
+from . import count_cache_lookups, count_upstream_response, observe_phase
+
 
 class IowaMetarDownloader:
     networks: Optional[pd.DataFrame] = None
@@ -24,6 +26,7 @@ class IowaMetarDownloader:
         self.download_url: str = metar_config['download-url']
         self.api_url: str = metar_config['api-url']
         self.data_path = os.path.join(metar_config['data-path'], 'iowa')
+        self.download_delay: float = metar_config.get('download-delay-seconds', 0.5)
 
     def download(self, stations:List[str], date_from:date, date_to:date) -> pd.DataFrame:
         chunk_size = 100
@@ -39,16 +42,18 @@ class IowaMetarDownloader:
             url += '&station=' + '&station='.join(partial_stations)
             # Download data from URL
             time_start = time.perf_counter()
-            download = requests.get(url)
+            with observe_phase('download', stations=len(partial_stations)):
+                download = requests.get(url)
             time_end = time.perf_counter()
             self.logger.info(f'Download took {time_end - time_start:.6f} seconds')
+            count_upstream_response('asos', download.status_code)
             download.raise_for_status()
             # Process and store data
             data_io = StringIO(download.text)
             data_chunks += [pd.read_csv(data_io)]
             if len(partial_stations) == chunk_size:
                 # Sleep between download calls
-                time.sleep(0.5)
+                time.sleep(self.download_delay)
         return pd.concat(data_chunks, ignore_index=True).drop_duplicates(subset=['station', 'valid'])
 
     def get_networks(self) -> pd.DataFrame:
@@ -61,6 +66,7 @@ class IowaMetarDownloader:
             The networks to find the stations for
         '''
         logging.info('Get all networks..')
+        count_cache_lookups('networks', int(IowaMetarDownloader.networks is not None), int(IowaMetarDownloader.networks is None))
         if IowaMetarDownloader.networks is None:
             # Data is not in memory - try to load
             filename = 'networks.json'
@@ -70,7 +76,9 @@ class IowaMetarDownloader:
                 # Data is not available - download
                 os.makedirs(os.path.dirname(path))
                 logging.info('Information about networks is not avaiable, downloading..')
-                response = requests.get(self.api_url + filename)
+                with observe_phase('download_metadata'):
+                    response = requests.get(self.api_url + filename)
+                count_upstream_response('networks', response.status_code)
                 response.raise_for_status()
                 with open(path, 'wb') as file:
                     file.write(response.content)
@@ -105,7 +113,9 @@ class IowaMetarDownloader:
         network_url = self.api_url + 'network/'
         for network in networks:
             logging.info(f'Get all stations of network {network}..')
-            if network not in IowaMetarDownloader.networks_to_stations:
+            is_cached = network in IowaMetarDownloader.networks_to_stations
+            count_cache_lookups('network_stations', int(is_cached), int(not is_cached))
+            if not is_cached:
                 # Data is not in memory - try to load
                 filename = f'{network}.geojson'
                 path = os.path.join(networks_path, filename)
@@ -114,10 +124,12 @@ class IowaMetarDownloader:
                     # Data is not available - download
                     os.makedirs(os.path.dirname(path), exist_ok=True)
                     logging.info(f'Information about stations in network {network} is not avaiable, downloading..')
-                    sleep_seconds = random.randint(1, 3)
+                    sleep_seconds = random.randint(2, 6) * self.download_delay
                     self.logger.debug(f'Sleeping for {sleep_seconds} seconds to reduce load on server..')
                     time.sleep(sleep_seconds)
-                    response = requests.get(network_url + filename)
+                    with observe_phase('download_metadata', network=network):
+                        response = requests.get(network_url + filename)
+                    count_upstream_response('network', response.status_code)
                     try:
                         response.raise_for_status()
                         with open(path, 'wb') as file:
@@ -1,30 +1,41 @@
 import json
 import logging
-from datetime import date, datetime
-from typing import Annotated, List
+import os
+import re
+from datetime import date, datetime, timezone
+from typing import Annotated, Dict, List, Optional
 
 import pandas as pd
 import pycountry
 import shapely.wkt
 from aimlsse_api.data.metar import MetarProperty
 from aimlsse_api.interface import GroundDataAccess
-from fastapi import APIRouter, Body, FastAPI, HTTPException
+from fastapi import APIRouter, Body, FastAPI, HTTPException, Request
 from fastapi.responses import FileResponse, JSONResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+import yaml
 from shapely import Polygon
 
-from . import IowaMetarDownloader, MetarDataProvider, MetarMap, StationControl
+from . import (DebugSampler, IowaMetarDownloader, MetarDataProvider, MetarMap, MetarQuery, StationControl, Trace,
+               TracingConfig, current_endpoint, current_trace, debug_sampled, observe_phase, sample_debug, span)
 
 
 class GroundDataService(GroundDataAccess):
     def __init__(self) -> None:
         super().__init__()
         self.logger = logging.getLogger(f'{__name__}.{self.__class__.__name__}')
+        self.tracing_config = TracingConfig(yaml.safe_load(open('config.yml')).get('tracing', {}))
         # Setup a router for FastAPI
         self.router = APIRouter()
         self.router.add_api_route('/queryMetar', self.queryMetar, methods=['POST'])
+        self.router.add_api_route('/queryMetarBatch', self.queryMetarBatch, methods=['POST'])
+        self.router.add_api_route('/queryMetarChanges', self.queryMetarChanges, methods=['POST'])
+        self.router.add_api_route('/aggregateMetar', self.aggregateMetar, methods=['POST'])
         self.router.add_api_route('/queryMetadata', self.queryMetadata, methods=['POST'])
         self.router.add_api_route('/getAllStations', self.getAllStations, methods=['GET'])
         self.router.add_api_route('/forceRebuildMap', self.forceRebuildMap, methods=['GET'])
+        self.router.add_api_route('/metrics', self.metrics, methods=['GET'])
+        self.router.add_api_route('/getTrace', self.getTrace, methods=['GET'])
     
     async def queryMetar(self, data:Annotated[dict, Body(
             examples=[
@@ -39,25 +50,110 @@ class GroundDataService(GroundDataAccess):
         parameters_present = self.validate_json_parameters(data, [['stations', 'polygons'], ['properties']])
         property_strings: List[str] = data['properties']
         properties = [MetarProperty.from_string(prop_str) for prop_str in property_strings]
-        stations: List[str] = []
-        if 'stations' in parameters_present[0]:
-            stations += data['stations']
-            self.logger.info(f'Querying METAR for stations:\n{stations}')
-        elif 'polygons' in parameters_present[0]:
-            polygon_strings: List[str] = data['polygons']
-            polygons: List[Polygon] = [shapely.wkt.loads(x) for x in polygon_strings]
-            self.logger.info(f'Querying METAR for stations in polygons:\n{polygons}')
-            stations_gdf = MetarMap().get_stations_in_polygons(polygons)
-            stations += stations_gdf['id'].to_list()
-        else:
-            raise HTTPException(status_code=400, detail='Neither stations nor polygons are defined')
-        stations = sorted([*set(stations)]) # Remove duplicate stations
+        stations = self.get_requested_stations(data, parameters_present[0])
         self.logger.info(f'Querying METAR for stations:\n{stations}')
         return JSONResponse(
-                json.loads(MetarDataProvider().query(stations, datetime_from, datetime_to, properties)
-                    .to_json(date_format='iso', orient='table', index=False))
+                self.serialize_table(MetarDataProvider().query(stations, datetime_from, datetime_to, properties))
             )
     
+    async def queryMetarBatch(self, data:Annotated[dict, Body(
+            examples=[
+                {
+                    'queries': [
+                        {
+                            'stations': ['EDDF', 'EDDV'],
+                            'datetime_from': '2023-01-01T00:00:00',
+                            'datetime_to': '2023-01-08T00:00:00'
+                        },
+                        {
+                            'polygons': ['POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))'],
+                            'datetime_from': '2023-01-05T00:00:00',
+                            'datetime_to': '2023-01-12T00:00:00'
+                        }
+                    ]
+                }
+            ]
+    )]):
+        self.validate_json_parameters(data, [['queries']])
+        if not isinstance(data['queries'], list) or len(data['queries']) == 0:
+            raise HTTPException(status_code=400, detail='Queries must be a non-empty list')
+        queries: List[MetarQuery] = []
+        for query_data in data['queries']:
+            parameters_present = self.validate_json_parameters(query_data,
+                [['stations', 'polygons'], ['properties'], ['datetime_from'], ['datetime_to']])
+            property_strings: List[str] = query_data['properties']
+            queries += [MetarQuery(
+                self.get_requested_stations(query_data, parameters_present[0]),
+                self.parse_datetime(query_data['datetime_from']),
+                self.parse_datetime(query_data['datetime_to']),
+                [MetarProperty.from_string(prop_str) for prop_str in property_strings]
+            )]
+        self.logger.info(f'Querying METAR for a batch of {len(queries)} queries:\n{queries}')
+        results = MetarDataProvider().query_batch(queries)
+        return JSONResponse([self.serialize_table(result) for result in results])
+
+    async def queryMetarChanges(self, data:Annotated[dict, Body(
+            examples=[
+                {
+                    'stations': ['EDDF', 'EDDV', 'ELLX', 'LOWL']
+                },
+                {
+                    'polygons': ['POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))', 'POLYGON ((0 0, 0 10, 10 10, 10 0))']
+                }
+            ]
+    )], since:Optional[datetime] = None, limit:int = 10000):
+        self.validate_json_parameters(data, [['properties']])
+        if limit < 1:
+            raise HTTPException(status_code=400, detail='The limit must be positive')
+        property_strings: List[str] = data['properties']
+        properties = [MetarProperty.from_string(prop_str) for prop_str in property_strings]
+        stations: Optional[List[str]] = None
+        station_parameters = list(filter(lambda x: x in data, ['stations', 'polygons']))
+        if len(station_parameters) > 0:
+            stations = self.get_requested_stations(data, station_parameters)
+        if since is not None:
+            since = self.to_naive_utc(since)
+        self.logger.info(f'Querying METAR ingested after {since}')
+        result, watermark, has_more = MetarDataProvider().query_changes(since, properties, stations, limit)
+        return JSONResponse({
+            'watermark': watermark.isoformat(),
+            'has_more': has_more,
+            'data': self.serialize_table(result)
+        })
+
+    async def aggregateMetar(self, data:Annotated[dict, Body(
+            examples=[
+                {
+                    'stations': ['EDDF', 'EDDV', 'ELLX', 'LOWL']
+                },
+                {
+                    'polygons': ['POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))', 'POLYGON ((0 0, 0 10, 10 10, 10 0))']
+                }
+            ]
+    )], datetime_from:datetime, datetime_to:datetime, frequency:str = '1h'):
+        parameters_present = self.validate_json_parameters(data, [['stations', 'polygons'], ['properties']])
+        property_strings: List[str] = data['properties']
+        properties = [MetarProperty.from_string(prop_str) for prop_str in property_strings]
+        aggregations: Optional[Dict[str, List[str]]] = None
+        if 'aggregations' in data:
+            if not isinstance(data['aggregations'], dict) or not all(
+                    isinstance(functions, list) and all(isinstance(function, str) for function in functions)
+                    for functions in data['aggregations'].values()):
+                raise HTTPException(status_code=400, detail='Aggregations must map properties to lists of statistics')
+            # Statistics are requested per property string - normalize them to the names of the result columns
+            aggregations = {str(MetarProperty.from_string(prop_str)): functions
+                for prop_str, functions in data['aggregations'].items()}
+        stations = self.get_requested_stations(data, parameters_present[0])
+        metar_data_provider = MetarDataProvider()
+        # Only the request is validated here - errors while querying and aggregating are not caused by the client
+        try:
+            metar_data_provider.get_aggregations(properties, frequency, aggregations)
+        except ValueError as error:
+            raise HTTPException(status_code=400, detail=str(error))
+        self.logger.info(f'Aggregating METAR with frequency {frequency} for stations:\n{stations}')
+        result = metar_data_provider.aggregate(stations, datetime_from, datetime_to, properties, frequency, aggregations)
+        return JSONResponse(self.serialize_table(result))
+
     async def queryMetadata(self, data:Annotated[dict, Body(
             examples=[
                 {
@@ -70,19 +166,7 @@ class GroundDataService(GroundDataAccess):
     )]):
         parameters_present = self.validate_json_parameters(data, [['stations', 'polygons']])
         metar_map = MetarMap()
-        stations: List[str] = []
-        if 'stations' in parameters_present[0]:
-            stations += data['stations']
-            self.logger.info(f'Querying metadata for stations:\n{stations}')
-        elif 'polygons' in parameters_present[0]:
-            polygon_strings: List[str] = data['polygons']
-            polygons: List[Polygon] = [shapely.wkt.loads(x) for x in polygon_strings]
-            self.logger.info(f'Querying metadata for stations in polygons:\n{polygons}')
-            stations_gdf = MetarMap().get_stations_in_polygons(polygons)
-            stations += stations_gdf['id'].to_list()
-        else:
-            raise HTTPException(status_code=400, detail='Neither stations nor polygons are defined')
-        stations = sorted([*set(stations)]) # Remove duplicate stations
+        stations = self.get_requested_stations(data, parameters_present[0])
         self.logger.info(f'Querying metadata for stations:\n{stations}')
         return JSONResponse(json.loads(metar_map.get_stations(stations).to_json()))
 
@@ -97,6 +181,82 @@ class GroundDataService(GroundDataAccess):
         MetarMap().force_rebuild()
         return Response()
 
+    async def metrics(self):
+        return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+    async def getTrace(self, trace_id:str):
+        # Trace IDs are generated as hex strings - anything else could point outside of the trace directory
+        if re.fullmatch('[0-9a-f]{32}', trace_id) is None:
+            raise HTTPException(status_code=400, detail=f'"{trace_id}" is not a valid trace ID')
+        path = os.path.join(self.tracing_config.trace_path, f'{trace_id}.json')
+        if not os.path.exists(path):
+            raise HTTPException(status_code=404, detail=f'Trace {trace_id} does not exist')
+        return FileResponse(path, media_type='application/json')
+
+    def serialize_table(self, data:pd.DataFrame) -> dict:
+        '''
+        Converts the data into the JSON table format that is returned by all METAR endpoints.
+        '''
+        with observe_phase('serialization'):
+            return json.loads(data.to_json(date_format='iso', orient='table', index=False))
+
+    def get_requested_stations(self, data:dict, station_parameters:List[str]) -> List[str]:
+        '''
+        Collects the stations that are requested either directly or by polygons that contain them.
+
+        Parameters
+        ----------
+        data: `JSON / dict`
+            The JSON that contains the stations or polygons
+        station_parameters: `List[str]`
+            The parameters about stations that are present in the data
+
+        Raises
+        ------
+        `HTTPException`
+            If neither stations nor polygons are present
+        
+        Returns
+        -------
+        `List[str]`
+            The sorted stations without duplicates
+        '''
+        stations: List[str] = []
+        if 'stations' in station_parameters:
+            stations += data['stations']
+        elif 'polygons' in station_parameters:
+            polygon_strings: List[str] = data['polygons']
+            polygons: List[Polygon] = [shapely.wkt.loads(x) for x in polygon_strings]
+            self.logger.info(f'Querying stations in polygons:\n{polygons}')
+            stations_gdf = MetarMap().get_stations_in_polygons(polygons)
+            stations += stations_gdf['id'].to_list()
+        else:
+            raise HTTPException(status_code=400, detail='Neither stations nor polygons are defined')
+        return sorted([*set(stations)]) # Remove duplicate stations
+
+    def parse_datetime(self, value:str) -> datetime:
+        '''
+        Parses an ISO 8601 datetime from a JSON body into a naive datetime in UTC, like the stored data.
+
+        Raises
+        ------
+        `HTTPException`
+            If the value is not a valid datetime
+        '''
+        try:
+            result = datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail=f'"{value}" is not a valid ISO 8601 datetime')
+        return self.to_naive_utc(result)
+
+    def to_naive_utc(self, value:datetime) -> datetime:
+        '''
+        Converts a datetime with timezone into a naive datetime in UTC, while naive datetimes are assumed to be in UTC already.
+        '''
+        if value.tzinfo is not None:
+            return value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
     def validate_json_parameters(self, data:dict, parameters:List[List[str]]) -> List[List[str]]:
         '''
         Ensures that the given JSON dict contains the specified parameters.
@@ -130,6 +290,42 @@ class GroundDataService(GroundDataAccess):
 
 logging.basicConfig(level=logging.DEBUG)
 logging.getLogger('fiona').setLevel(logging.INFO)
+for handler in logging.getLogger().handlers:
+    handler.addFilter(DebugSampler())
 app = FastAPI()
 groundDataService = GroundDataService()
-app.include_router(groundDataService.router)
\ No newline at end of file
+app.include_router(groundDataService.router)
+endpoints = [route.path for route in groundDataService.router.routes]
+
+@app.middleware('http')
+async def label_metrics_with_endpoint(request:Request, call_next):
+    # Unknown paths share one label, so they can not blow up the number of time series
+    token = current_endpoint.set(request.url.path if request.url.path in endpoints else 'unknown')
+    try:
+        return await call_next(request)
+    finally:
+        current_endpoint.reset(token)
+
+@app.middleware('http')
+async def trace_request(request:Request, call_next):
+    # Requests opt in with "X-Trace: spans" or additionally profile themselves with "X-Trace: profile"
+    tracing_config = groundDataService.tracing_config
+    mode = request.headers.get('x-trace', '').lower() if tracing_config.enabled else ''
+    if mode == 'profile' and not tracing_config.profiling:
+        mode = 'spans'
+    trace = Trace(request.url.path, profile=(mode == 'profile')) if mode in ['spans', 'profile'] else None
+    trace_token = current_trace.set(trace)
+    sampled_token = debug_sampled.set(sample_debug(tracing_config.debug_sample_rate))
+    try:
+        if trace is None:
+            return await call_next(request)
+        with trace.profiling(tracing_config.profile_entries):
+            with span('request', method=request.method, path=request.url.path):
+                response = await call_next(request)
+        trace.write(tracing_config.trace_path, tracing_config.max_traces)
+        response.headers['X-Trace-Id'] = trace.trace_id
+        response.headers['Server-Timing'] = trace.get_server_timing()
+        return response
+    finally:
+        debug_sampled.reset(sampled_token)
+        current_trace.reset(trace_token)
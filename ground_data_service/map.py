@@ -9,7 +9,7 @@ import pycountry
 import yaml
 from shapely import Polygon
 
-from . import IowaMetarDownloader
+from . import IowaMetarDownloader, count_cache_lookups, span
 
 
 class MetarMap:
@@ -29,12 +29,15 @@ class MetarMap:
         return MetarMap.countries[['ISO_A3_EH', 'NAME', 'CONTINENT', 'geometry']]
     
     def get_all_stations(self) -> gpd.GeoDataFrame:
+        count_cache_lookups('station_map', int(MetarMap.stations is not None), int(MetarMap.stations is None))
         if MetarMap.stations is None:
-            self.__load()
+            with span('map_load'):
+                self.__load()
         return MetarMap.stations
 
     def force_rebuild(self):
-        self.__build()
+        with span('map_build'):
+            self.__build()
 
     def __build(self):
         self.logger.info('Building Stations-per-Country dict..')
@@ -44,7 +47,7 @@ class MetarMap:
         stations.drop(['country'], axis=1, inplace=True) # Remove wrong country name
         self.logger.info('Querying countries..')
         countries = self.__get_countries()
-        self.logger.debug(f'Countries-CRS = {countries.crs}, Stations-CRS = {stations.crs}')
+        self.logger.debug('Countries-CRS = %s, Stations-CRS = %s', countries.crs, stations.crs)
         assert countries.crs == stations.crs, 'GeoDataFrames for countries and stations have different CRS, which is not allowed'
         countries = countries.rename(columns={'NAME':'country'})
         self.logger.info(f'Mapping {len(stations)} stations to {len(countries)} countries..')
@@ -105,8 +108,9 @@ class MetarMap:
         return data[data.within(polygon)]
     
     def get_stations_in_polygons(self, polygons:List[Polygon]) -> gpd.GeoDataFrame:
-        data = [self.get_stations_in_polygon(x) for x in polygons]
-        return gpd.GeoDataFrame(pd.concat(data))
+        with span('map_polygons', polygons=len(polygons)):
+            data = [self.get_stations_in_polygon(x) for x in polygons]
+            return gpd.GeoDataFrame(pd.concat(data))
 
     def exists(self, stations:List[str]) -> Tuple[bool, List[bool]]:
         data = self.get_all_stations()
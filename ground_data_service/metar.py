@@ -1,114 +1,117 @@
 import logging
 import time
-from datetime import date, datetime, timedelta
-from typing import Dict, List
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
-import sqlalchemy as db
-import sqlalchemy.orm as orm
 import yaml
 from aimlsse_api.data.metar import *
 from metar import Metar
 
-from . import DateChunker, IowaMetarDownloader, MetarWrapper, StationControl
+from . import (CompactMetarStore, DatabaseConfig, DatabaseMetarStore, DateChunker, IowaMetarDownloader,
+               MetarAggregator, MetarStore, MetarWrapper, ParquetMetarStore, StationControl, StorageConfig,
+               count_cache_lookups, count_parse_failures, count_rows, create_schema, observe_phase, span)
 
 
-class DatabaseConfig:
-
-    def __init__(self, config:dict) -> None:
-        self.technology = config['technology']
-        self.name       = config['name']
-        self.username   = config['username']
-        self.password   = config['password']
-        self.host       = config['host']
-        self.port       = config['port']
-    
-    def createDatabase(self) -> db.engine.Engine:
-        return db.create_engine(f'{self.technology}://{self.username}:{self.password}@{self.host}:{self.port}/{self.name}', echo=True)
-
-class Base(orm.DeclarativeBase):
-    pass
-
-class MetarData(Base):
-    __tablename__ = 'metar_data'
-
-    station = orm.mapped_column(db.String, primary_key=True)
-    datetime = orm.mapped_column(db.DateTime, primary_key=True)
-    metar = orm.mapped_column(db.String)
+class MetarQuery:
+    '''
+    A single query for METAR data, as part of a batch.
+    '''
+    def __init__(self, stations:List[str], datetime_from:datetime, datetime_to:datetime,
+            properties:List[MetarProperty]) -> None:
+        self.stations = stations
+        self.datetime_from = datetime_from
+        self.datetime_to = datetime_to
+        self.properties = properties
 
     def __repr__(self) -> str:
-        return f'MetarData(station={self.station!r}, datetime={self.datetime!r}, metar={self.metar!r})'    
+        return f'MetarQuery(stations={self.stations}, datetime_from={self.datetime_from}, datetime_to={self.datetime_to})'
 
 class MetarDataProvider:
+    change_feed_lag = timedelta(seconds=10)
+    '''
+    Rows are only handed out by the change feed once they have been ingested for this long.
+    This covers the moment between taking the ingest time and registering the ingest, as well as clock differences
+    between instances. Longer ingests hold back the watermark until they are done, regardless of this lag.
+    '''
 
     def __init__(self) -> None:
         self.logger = logging.getLogger(f'{__name__}.{self.__class__.__name__}')
         config = yaml.safe_load(open('config.yml'))
-        self.db_config = DatabaseConfig(config['database'])
-        self.db_engine = self.db_config.createDatabase()
         self.download_url: str = config['metar']['download-url']
-        Base.metadata.create_all(self.db_engine)
+        self.download_delay: float = config['metar'].get('download-delay-seconds', 0.5)
+        self.store = self.create_store(config)
+
+    def create_store(self, config:dict) -> MetarStore:
+        '''
+        Creates the configured storage backend, which is the database unless the `storage` section selects Parquet.
+
+        Raises
+        ------
+        `ValueError`
+            If the backend is not known
+        '''
+        storage_config = StorageConfig(config.get('storage', {}))
+        if storage_config.backend == 'parquet':
+            return ParquetMetarStore(storage_config.data_path)
+        elif storage_config.backend != 'database':
+            raise ValueError(f'Storage backend {storage_config.backend} is not known')
+        db_config = DatabaseConfig(config['database'])
+        db_engine = db_config.createDatabase()
+        partitioner = create_schema(db_engine, db_config)
+        if db_config.layout == 'compact':
+            return CompactMetarStore(db_engine, partitioner)
+        return DatabaseMetarStore(db_engine, partitioner)
 
     def store_data(self, data:pd.DataFrame):
-        with orm.Session(self.db_engine) as session:
-            metar_data = []
-            for index, row in data.iterrows():
-                metar_data += [MetarData(station=row['station'], datetime=row['datetime'], metar=row['metar'])]
-            self.logger.debug(f'Storing data: {metar_data}')
-            session.add_all(metar_data)
-            session.commit()
-            self.logger.info(f'Stored data in database')
+        count_rows('stored', len(data))
+        with observe_phase('ingest'):
+            self.store.store_data(data, datetime.now(timezone.utc).replace(tzinfo=None))
 
     def download_data(self, stations:List[str], date_from:date, date_to:date) -> pd.DataFrame:
         stations = StationControl().prepare_stations_for_processing(stations)
         data = IowaMetarDownloader().download(stations, date_from, date_to)
         data.columns = ['station', 'datetime', 'metar']
         data['datetime'] = pd.to_datetime(data['datetime'])
+        count_rows('downloaded', len(data))
         return data
     
     def query_data(self, stations:List[str], datetime_from:datetime, datetime_to:datetime) -> pd.DataFrame:
         self.logger.info(f'Querying data for stations {stations}\n from {datetime_from} until {datetime_to}')
-        metar_data = None
-        with orm.Session(self.db_engine) as session:
-            stmt = (
-                db.select(MetarData.station, MetarData.datetime, MetarData.metar)
-                .where(MetarData.station.in_(stations))
-                .where(MetarData.datetime >= str(datetime_from))
-                .where(MetarData.datetime < str(datetime_to))
-                .order_by(db.asc(MetarData.station), db.asc(MetarData.datetime))
-            )
-            metar_data: db.engine.result.ChunkedIteratorResult = session.execute(stmt)
-        # Format output
-        self.logger.debug(f'Queried METAR data type: {type(metar_data)}')
-        result = pd.DataFrame(metar_data.all(), columns=['station', 'datetime', 'metar'])
-        self.logger.debug(f'Result of query:\n{result}')
+        with observe_phase('db_read'):
+            result = self.store.query_data(stations, datetime_from, datetime_to)
         self.logger.info('Query for data of stations complete')
         return result
     
+    def query_changed_data(self, since:Optional[datetime], until:datetime,
+            stations:Optional[List[str]] = None) -> pd.DataFrame:
+        '''
+        Queries the reports that have been ingested in the given time-range.
+
+        Parameters
+        ----------
+        since: `Optional[datetime]`
+            The exclusive start of the ingest time-range, or None to include all data from before `until`
+        until: `datetime`
+            The inclusive end of the ingest time-range
+        stations: `Optional[List[str]]`
+            The stations to restrict the result to, or None for all stations
+
+        Returns
+        -------
+        `DataFrame`
+            The data with the columns `station`, `datetime`, `metar` and `ingested_at`, ordered by ingest time
+        '''
+        self.logger.info(f'Querying data ingested after {since} until {until}')
+        with observe_phase('db_read'):
+            result = self.store.query_changed_data(since, until, stations)
+        self.logger.info(f'Query for ingested data complete, found {len(result)} rows')
+        return result
+
     def query_dates(self, stations:List[str], date_from:date, date_to:date) -> Dict[str, np.ndarray[np.datetime64]]:
         self.logger.info(f'Querying datetimes for stations {stations}\n from {date_from} until {date_to}')
-        datetime_data = None
-        with orm.Session(self.db_engine) as session:
-            stmt = (
-                db.select(MetarData.station, MetarData.datetime)
-                .where(MetarData.station.in_(stations))
-                .where(MetarData.datetime >= str(date_from))
-                .where(MetarData.datetime < str(date_to))
-                .order_by(db.asc(MetarData.station), db.asc(MetarData.datetime))
-            )
-            datetime_data: db.engine.result.ChunkedIteratorResult = session.execute(stmt)
-        # Format output
-        self.logger.debug(f'Queried data type: {type(datetime_data)}')
-        result: Dict[str, np.ndarray[np.datetime64]] = {}
-        for station in stations:
-            result[station] = np.array([], dtype='datetime64')
-        for station, datetime_observation in datetime_data.tuples():
-            assert isinstance(datetime_observation, datetime)
-            result[station] = np.append(result[station], np.datetime64(datetime_observation, 'D'))
-        for station, datetime_observations in result.items():
-            result[station] = np.unique(datetime_observations)
-        self.logger.debug(f'Result of query:\n{result}')
+        result = self.store.query_dates(stations, date_from, date_to)
         self.logger.info('Query for datetimes of stations complete')
         return result
 
@@ -122,92 +125,168 @@ class MetarDataProvider:
     def unfoldMetar(self, metar:Metar.Metar, properties:List[MetarProperty]):
         return pd.Series(MetarWrapper(metar).get(properties))
 
-    def query(self, stations:List[str], datetime_from:datetime, datetime_to:datetime,
-        properties:List[MetarProperty]) -> pd.DataFrame:
-
-        time_start = time.perf_counter()
-        stations = StationControl().prepare_stations_for_processing(stations)
+    def get_days(self, datetime_from:datetime, datetime_to:datetime) -> np.ndarray[np.datetime64]:
+        '''
+        Lists all days that are touched by the given time-range, as the data is downloaded and stored per day.
+        '''
         date_from = datetime_from.date()
         date_to = datetime_to.date() + timedelta(days=1)
         # Create index of what date-range is requested, to be able to use the difference() function
         if (date_to - date_from).days == 0:
             # Only one day - can not be created with pandas.date_range - create manually
-            query_date_range = np.array([date_from], dtype='datetime64[D]')
-        else:
-            # Ensure consistency by making the date-range an interval with open end
-            query_date_range = np.arange(date_from, date_to, dtype='datetime64[D]')
-        self.logger.debug(f'Query date range: {query_date_range}')
+            return np.array([date_from], dtype='datetime64[D]')
+        # Ensure consistency by making the date-range an interval with open end
+        return np.arange(date_from, date_to, dtype='datetime64[D]')
+
+    def get_station_day_index(self, station_days:Dict[str, np.ndarray[np.datetime64]]) -> pd.MultiIndex:
+        '''
+        Flattens days per station into one index of (station, day) pairs, so sets of station days
+        can be compared with vectorized operations instead of one operation per station.
+        '''
+        stations = list(station_days.keys())
+        days = list(station_days.values())
+        return pd.MultiIndex.from_arrays([
+            np.repeat(np.array(stations, dtype=object), [len(x) for x in days]),
+            np.concatenate(days).astype('datetime64[D]') if len(days) > 0 else np.array([], dtype='datetime64[D]')
+        ], names=['station', 'day'])
+
+    def reconcile_download(self, data:pd.DataFrame, coverage:pd.MultiIndex, missing:pd.MultiIndex) -> pd.DataFrame:
+        '''
+        Prepares downloaded data for storage by removing the reports of days that are already stored
+        and by adding empty rows for missing days without any report, which marks them as available.
+
+        Parameters
+        ----------
+        data: `DataFrame`
+            The downloaded data with the columns `station`, `datetime` and `metar`
+        coverage: `MultiIndex`
+            The (station, day) pairs that are already stored
+        missing: `MultiIndex`
+            The (station, day) pairs that the download was meant to fill
+
+        Returns
+        -------
+        `DataFrame`
+            The rows to store
+        '''
+        downloaded = pd.MultiIndex.from_arrays([data['station'].values, data['datetime'].values.astype('datetime64[D]')],
+            names=['station', 'day'])
+        data = data.loc[~downloaded.isin(coverage)]
+        empty = missing[~missing.isin(downloaded)]
+        empty_data = pd.DataFrame({
+            'station': empty.get_level_values('station'),
+            'datetime': empty.get_level_values('day'),
+            'metar': None
+        })
+        return pd.concat([data, empty_data], ignore_index=True)
+
+    def query_coverage(self, station_days:Dict[str, np.ndarray[np.datetime64]]) -> pd.MultiIndex:
+        '''
+        Queries which of the given days are already stored per station.
+
+        Stations with the same days are checked together, once per contiguous range of their days,
+        so days between the ranges of a batch are not read.
+
+        Parameters
+        ----------
+        station_days: `Dict[str, np.ndarray[np.datetime64]]`
+            The sorted days per station, which must not be empty
+
+        Returns
+        -------
+        `MultiIndex`
+            The (station, day) pairs that are already stored
+        '''
+        day_stations: Dict[bytes, List[str]] = {}
+        for station, days in station_days.items():
+            day_stations.setdefault(days.astype('datetime64[D]').tobytes(), []).append(station)
+        coverage_parts = []
+        for days_key, stations in day_stations.items():
+            days = np.frombuffer(days_key, dtype='datetime64[D]')
+            for chunk in DateChunker.extend_chunks(DateChunker.build_contiguous_chunks_from_dates(days)):
+                coverage_parts += [self.get_station_day_index(self.query_dates(stations, chunk.start, chunk.end))]
+        return coverage_parts[0].append(coverage_parts[1:])
+
+    def ensure_data(self, station_days:Dict[str, np.ndarray[np.datetime64]]):
+        '''
+        Downloads and stores the data of all given days that are not yet available in the database.
+
+        Parameters
+        ----------
+        station_days: `Dict[str, np.ndarray[np.datetime64]]`
+            The sorted days per station, for which data has to be available
+        '''
+        requested = self.get_station_day_index(station_days)
+        if len(requested) == 0:
+            # Like queries that end before they start, or that have no stations
+            return
 
         # Query what data is already available
         self.logger.info(f'Checking what parts of the data are available..')
-        station_date_sets = self.query_dates(stations, date_from, date_to) # does not work when date_from == date_to
-        self.logger.debug(f'Station date sets: {station_date_sets}')
+        with observe_phase('coverage_check'):
+            coverage = self.query_coverage(station_days)
+        self.logger.debug('Station days available: %s', coverage)
 
-        # Find which date-ranges are missing and should be downloaded
-        date_diffs: Dict[str, np.ndarray[np.datetime64]] = {}
-        for station, dates in station_date_sets.items():
-            date_diffs[station] = np.setdiff1d(query_date_range, dates)
-        self.logger.debug(f'Date diffs: {date_diffs}')
-
-        # Note which stations are missing data
-        stations_with_missing_data: Dict[str, np.ndarray[np.datetime64]] = dict(
-            filter(lambda x: len(x[1]) > 0, date_diffs.items()))
+        # Find which station days are missing and should be downloaded
+        missing = requested[~requested.isin(coverage)]
+        count_cache_lookups('station_days', len(requested) - len(missing), len(missing))
+        self.logger.debug('Station days missing: %s', missing)
 
         # Decision: Only download data for all stations to reduce number of remote-calls
-        date_diffs_values = np.array([], dtype=np.datetime64)
-        for station, dates in stations_with_missing_data.items():
-            date_diffs_values = np.append(date_diffs_values, dates)
-        unified_date_diffs = np.unique(date_diffs_values)
-        self.logger.debug(f'Dates to query for all selected stations:\n{unified_date_diffs}')
+        missing_days = missing.get_level_values('day').values.astype('datetime64[D]')
+        unified_date_diffs = np.unique(missing_days)
+        self.logger.debug('Dates to query for all selected stations:\n%s', unified_date_diffs)
 
         # Structurize missing date-ranges and download them
-        if len(unified_date_diffs) != 0:
-            # Missing date-ranges have to be downloaded
-            self.logger.info(f'Downloading missing data..')
-            # Start with preprocessing
-            chunks = DateChunker.build_contiguous_chunks_from_dates(unified_date_diffs)
-            self.logger.debug(f'Chunks:\n{chunks}')
-            # Make sure chunks can be downloaded - intervals are [x, y) - to include y make interval [x, y + 1)
-            chunks = DateChunker.extend_chunks(chunks)
-            self.logger.debug(f'Extended chunks:\n{chunks}')
-            # Continue with download per chunk
-            for chunk in chunks:
-                sleep_seconds = 0.5
-                self.logger.debug(f'Sleeping for {sleep_seconds} seconds to reduce load on server..')
-                time.sleep(sleep_seconds)
-                stations_to_query = list(stations_with_missing_data.keys())
+        if len(unified_date_diffs) == 0:
+            self.logger.info(f'All data available!')
+            return
+        # Missing date-ranges have to be downloaded
+        self.logger.info(f'Downloading missing data..')
+        # Start with preprocessing
+        chunks = DateChunker.build_contiguous_chunks_from_dates(unified_date_diffs)
+        self.logger.debug('Chunks:\n%s', chunks)
+        # Make sure chunks can be downloaded - intervals are [x, y) - to include y make interval [x, y + 1)
+        chunks = DateChunker.extend_chunks(chunks)
+        self.logger.debug('Extended chunks:\n%s', chunks)
+        # Continue with download per chunk
+        for chunk in chunks:
+            sleep_seconds = self.download_delay
+            self.logger.debug(f'Sleeping for {sleep_seconds} seconds to reduce load on server..')
+            time.sleep(sleep_seconds)
+            # Only stations that miss data inside of this chunk are downloaded
+            chunk_missing = missing[(missing_days >= np.datetime64(chunk.start, 'D'))
+                & (missing_days < np.datetime64(chunk.end, 'D'))]
+            stations_to_query = chunk_missing.get_level_values('station').unique().tolist()
+            with span('download_chunk', stations=len(stations_to_query), date_from=str(chunk.start), date_to=str(chunk.end)):
                 data = self.download_data(stations_to_query, chunk.start, chunk.end)
-                printable_subset = data[['station', 'datetime']]
-                self.logger.debug('Data:\n'
-                    + data.to_string(None, columns=['station', 'datetime']))
-                for station, dates in station_date_sets.items():
-                    data = data.loc[~((data['station'] == station) & (data['datetime'].dt.date.isin(dates)))]
-                printable_subset = data[['station', 'datetime']]
-                self.logger.debug('Remaining data to store:\n'
-                    + data.to_string(None, columns=['station', 'datetime']))
-                none_data_to_insert = []
-                for station, dates in stations_with_missing_data.items():
-                    dates_df = pd.DataFrame(dates, columns=['datetime'])
-                    dates_df['exists'] = dates_df['datetime'].isin(data.loc[data['station'] == station]['datetime'].dt.date)
-                    dates_df = dates_df.loc[~dates_df['exists']][['datetime']]
-                    self.logger.debug(f'Station {station} is missing data for dates {dates_df.datetime}')
-                    dates_df['station'] = station
-                    dates_df['metar'] = None
-                    none_data_to_insert += [dates_df]
-                data = pd.concat([data] + none_data_to_insert, ignore_index=True)
-                self.logger.debug(f'None will be inserted for:\n{data}')
+                with observe_phase('reconcile'):
+                    data = self.reconcile_download(data, coverage, chunk_missing)
+                self.logger.debug('Data to store:\n%s', data)
                 self.store_data(data)
-            self.logger.info(f'Data download complete!')
-        else:
-            self.logger.info(f'All data available!')
+        self.logger.info(f'Data download complete!')
 
-        # Query the actual data
-        self.logger.info(f'Querying data from database..')
-        data = self.query_data(stations, datetime_from, datetime_to)
+    def decode_data(self, data:pd.DataFrame, properties:List[MetarProperty]) -> Tuple[pd.DataFrame, float, float]:
+        '''
+        Decodes the raw METAR of the data and extracts the requested properties into columns.
 
-        # Decode METAR and get requested properties
+        Rows without METAR or with METAR that can not be decoded are removed.
+
+        Parameters
+        ----------
+        data: `DataFrame`
+            The data with the columns `station`, `datetime` and `metar`
+        properties: `List[MetarProperty]`
+            The properties to extract
+
+        Returns
+        -------
+        `Tuple[DataFrame, float, float]`
+            The data with one column per property instead of the raw METAR,
+            followed by the seconds spent on decoding and on unfolding
+        '''
         property_names = [str(property) for property in properties]
-        self.logger.debug(f'property-names: {property_names}')
+        self.logger.debug('property-names: %s', property_names)
         data.dropna(subset=['metar'], inplace=True) # Get rid of None values from database
         if data.empty:
             data = pd.DataFrame(columns = data.columns.tolist() + property_names)
@@ -216,19 +295,40 @@ class MetarDataProvider:
             data.drop(columns=['metar'], inplace=True)
         else:
             time_start_decode = time.perf_counter()
-            data['decoded_metar'] = data.apply(lambda row: self.decode_metar(row.metar, row.datetime), axis=1)
+            with observe_phase('decode'):
+                data['decoded_metar'] = data.apply(lambda row: self.decode_metar(row.metar, row.datetime), axis=1)
             time_end_decode = time.perf_counter()
             time_decode = time_end_decode - time_start_decode
             data.drop(columns=['metar'], inplace=True) # remove raw METAR that has already been decoded
-            data.dropna(inplace=True) # remove non-decodable METAR rows
+            rows_before_decode = len(data)
+            data.dropna(subset=['decoded_metar'], inplace=True) # remove non-decodable METAR rows
+            count_parse_failures(rows_before_decode - len(data))
+            count_rows('decoded', len(data))
             time_start_unfold = time.perf_counter()
-            data[property_names] = data.apply(lambda x: self.unfoldMetar(x['decoded_metar'], properties), axis=1)
+            with observe_phase('unfold'):
+                data[property_names] = data.apply(lambda x: self.unfoldMetar(x['decoded_metar'], properties), axis=1)
             time_end_unfold = time.perf_counter()
             time_unfold = time_end_unfold - time_start_unfold
             data.drop(columns=['decoded_metar'], inplace=True) # remove decoded METAR that has already been unfolded
+        return data, time_decode, time_unfold
+
+    def query(self, stations:List[str], datetime_from:datetime, datetime_to:datetime,
+        properties:List[MetarProperty]) -> pd.DataFrame:
+
+        time_start = time.perf_counter()
+        stations = StationControl().prepare_stations_for_processing(stations)
+        query_date_range = self.get_days(datetime_from, datetime_to)
+        self.logger.debug('Query date range: %s', query_date_range)
+        with span('ensure_data', stations=len(stations), days=len(query_date_range)):
+            self.ensure_data({station: query_date_range for station in stations})
+
+        # Query the actual data
+        self.logger.info(f'Querying data from database..')
+        data = self.query_data(stations, datetime_from, datetime_to)
+
+        # Decode METAR and get requested properties
+        data, time_decode, time_unfold = self.decode_data(data, properties)
 
-        printable_subset = data[['station', 'datetime']]
-        self.logger.debug(f'Data queried (only station and datetime):\n{printable_subset}')
         time_end = time.perf_counter()
         time_total = time_end - time_start
         self.logger.info(
@@ -236,4 +336,200 @@ class MetarDataProvider:
             f'Decoding METAR took {time_decode:.6f} seconds, which is {100.0 * time_decode / time_total :.1f} % of total time.\n'
             f'Unfolding METAR took {time_unfold:.6f} seconds, which is {100.0 * time_unfold / time_total :.1f} % of total time.'
         )
-        return data
\ No newline at end of file
+        return data
+
+    def query_batch(self, queries:List[MetarQuery]) -> List[pd.DataFrame]:
+        '''
+        Answers multiple queries at once.
+
+        The coverage check and download are planned for all queries together,
+        each distinct report is read and decoded only once and the results are split up per query afterwards.
+
+        Parameters
+        ----------
+        queries: `List[MetarQuery]`
+            The queries to answer
+
+        Returns
+        -------
+        `List[DataFrame]`
+            The result of each query, in the same format and order as the results of `query`
+        '''
+        time_start = time.perf_counter()
+        station_control = StationControl()
+        station_control.verify_stations(station_control.format_stations(
+            [station for query in queries for station in query.stations]))
+        for query in queries:
+            query.stations = sorted(set(station_control.format_stations(query.stations)))
+
+        # Plan the coverage check and download for the days of all queries together
+        station_days: Dict[str, np.ndarray[np.datetime64]] = {}
+        for query in queries:
+            query_date_range = self.get_days(query.datetime_from, query.datetime_to)
+            for station in query.stations:
+                station_days[station] = np.union1d(station_days.get(station, query_date_range), query_date_range)
+        with span('ensure_data', stations=len(station_days)):
+            self.ensure_data(station_days)
+
+        # Read each report only once by merging overlapping time-ranges of the queries per station,
+        # so stations are not read over the time-ranges of queries that do not contain them
+        station_windows: Dict[str, List[Tuple[datetime, datetime]]] = {}
+        for query in sorted(queries, key=lambda x: x.datetime_from):
+            for station in query.stations:
+                windows = station_windows.setdefault(station, [])
+                if len(windows) > 0 and query.datetime_from <= windows[-1][1]:
+                    windows[-1] = (windows[-1][0], max(windows[-1][1], query.datetime_to))
+                else:
+                    windows += [(query.datetime_from, query.datetime_to)]
+        # Stations with the same time-ranges are read together
+        window_stations: Dict[Tuple[Tuple[datetime, datetime], ...], List[str]] = {}
+        for station, windows in station_windows.items():
+            window_stations.setdefault(tuple(windows), []).append(station)
+        data_parts = [
+            self.query_data(sorted(stations), window_start, window_end)
+            for windows, stations in window_stations.items()
+            for window_start, window_end in windows
+        ]
+        data = pd.concat(data_parts, ignore_index=True)
+
+        # Decode every report once with the properties of all queries
+        properties = list({str(property): property for query in queries for property in query.properties}.values())
+        data, time_decode, time_unfold = self.decode_data(data, properties)
+
+        results = []
+        for query in queries:
+            mask = (data['station'].isin(query.stations)
+                & (data['datetime'] >= query.datetime_from) & (data['datetime'] < query.datetime_to))
+            columns = ['station', 'datetime'] + [str(property) for property in query.properties]
+            results += [data.loc[mask, columns].reset_index(drop=True)]
+        time_total = time.perf_counter() - time_start
+        self.logger.info(
+            f'Batch of {len(queries)} queries with {len(data)} distinct reports took {time_total:.6f} seconds in total.\n'
+            f'Decoding METAR took {time_decode:.6f} seconds, unfolding METAR took {time_unfold:.6f} seconds.'
+        )
+        return results
+
+    def get_aggregations(self, properties:List[MetarProperty], frequency:str,
+            aggregations:Optional[Dict[str, List[str]]] = None) -> Dict[str, List[str]]:
+        '''
+        Validates the parameters of `aggregate` without querying any data.
+
+        Raises
+        ------
+        `ValueError`
+            If the frequency, a property or a statistic can not be used for aggregation
+
+        Returns
+        -------
+        `Dict[str, List[str]]`
+            The statistics per property name
+        '''
+        pd.tseries.frequencies.to_offset(frequency)
+        return MetarAggregator().get_aggregations(properties, aggregations)
+
+    def aggregate(self, stations:List[str], datetime_from:datetime, datetime_to:datetime,
+        properties:List[MetarProperty], frequency:str, aggregations:Optional[Dict[str, List[str]]] = None) -> pd.DataFrame:
+        '''
+        Queries the METAR data like `query` and resamples it into statistics per station and time interval.
+
+        Parameters
+        ----------
+        stations: `List[str]`
+            The stations to query
+        datetime_from: `datetime`
+            The start of the queried time-range
+        datetime_to: `datetime`
+            The end of the queried time-range
+        properties: `List[MetarProperty]`
+            The properties to aggregate
+        frequency: `str`
+            The length of the time intervals as pandas offset alias, like `1h` or `1D`
+        aggregations: `Optional[Dict[str, List[str]]]`
+            The statistics per property name, which override the defaults of `MetarAggregator`
+
+        Raises
+        ------
+        `ValueError`
+            If the frequency, a property or a statistic can not be used for aggregation
+
+        Returns
+        -------
+        `DataFrame`
+            The statistics per station and time interval
+        '''
+        # Validate everything before downloading and decoding data
+        property_aggregations = self.get_aggregations(properties, frequency, aggregations)
+        data = self.query(stations, datetime_from, datetime_to, properties)
+        time_start = time.perf_counter()
+        with span('aggregate', frequency=frequency):
+            result = MetarAggregator().aggregate(data, property_aggregations, frequency)
+        self.logger.info(f'Aggregation took {time.perf_counter() - time_start:.6f} seconds')
+        return result
+
+    def query_changes(self, since:Optional[datetime], properties:List[MetarProperty],
+            stations:Optional[List[str]] = None, limit:Optional[int] = None) -> Tuple[pd.DataFrame, datetime, bool]:
+        '''
+        Queries the observations that have been ingested after a watermark, decoded like in `query`.
+
+        Parameters
+        ----------
+        since: `Optional[datetime]`
+            The watermark returned by the previous call, or None to start from the beginning
+        properties: `List[MetarProperty]`
+            The properties to extract
+        stations: `Optional[List[str]]`
+            The stations to restrict the result to, or None for all stations
+        limit: `Optional[int]`
+            The number of reports per call, or None to return all of them at once.
+            Pages always contain whole ingests, as all reports of an ingest share one ingest time,
+            so a single ingest that is larger than the limit is returned as a whole
+
+        Returns
+        -------
+        `Tuple[DataFrame, datetime, bool]`
+            The decoded observations with their ingest time, followed by the watermark for the next call
+            and whether there are more observations before the current watermark
+        '''
+        if stations is not None:
+            stations = StationControl().format_stations(stations)
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        until = now - MetarDataProvider.change_feed_lag
+        # Rows of ingests in progress may still be committed with an ingest time before the watermark
+        oldest_ingest = self.store.get_oldest_ingest(now)
+        if oldest_ingest is not None:
+            until = min(until, oldest_ingest - timedelta(microseconds=1))
+        has_more = False
+        if since is not None and since >= until:
+            until = since
+            data = pd.DataFrame(columns=['station', 'datetime', 'metar', 'ingested_at'])
+        else:
+            if limit is not None:
+                page_end = self.get_page_end(since, until, stations, limit)
+                if page_end is not None:
+                    until = page_end
+                    has_more = True
+            data = self.query_changed_data(since, until, stations)
+        data, time_decode, time_unfold = self.decode_data(data, properties)
+        self.logger.info(f'Found {len(data)} observations ingested after {since}, next watermark is {until}')
+        return data, until, has_more
+
+    def get_page_end(self, since:Optional[datetime], until:datetime, stations:Optional[List[str]],
+            limit:int) -> Optional[datetime]:
+        '''
+        Determines the end of a page of the change feed, which holds as many whole ingests as fit into the limit,
+        but at least one.
+
+        Returns
+        -------
+        `Optional[datetime]`
+            The last ingest time of the page, or None if all ingests until `until` fit into the page
+        '''
+        ingest_sizes = self.store.query_ingest_sizes(since, until, stations)
+        ingests = max(1, int((ingest_sizes['rows'].cumsum() <= limit).sum()))
+        if ingests >= len(ingest_sizes):
+            return None
+        page_end = ingest_sizes['ingested_at'].iloc[ingests - 1]
+        if pd.isna(page_end):
+            # The page only holds the reports from before ingest times were recorded, which are included before any ingest
+            return pd.Timestamp(ingest_sizes['ingested_at'].iloc[ingests]).to_pydatetime() - timedelta(microseconds=1)
+        return pd.Timestamp(page_end).to_pydatetime()
@@ -0,0 +1,73 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from prometheus_client import Counter, Histogram
+
+from . import span
+
+current_endpoint: ContextVar[str] = ContextVar('current_endpoint', default='none')
+'''
+The endpoint that is currently being served, which labels all metrics that are recorded while serving it
+'''
+
+PHASE_SECONDS = Histogram(
+    'ground_data_phase_seconds',
+    'Duration of the phases of the METAR pipeline, downloads are observed per upstream request',
+    ['endpoint', 'phase'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+)
+ROWS = Counter(
+    'ground_data_rows_total',
+    'Rows that passed a stage of the METAR pipeline',
+    ['endpoint', 'stage']
+)
+METAR_PARSE_FAILURES = Counter(
+    'ground_data_metar_parse_failures_total',
+    'METAR reports that could not be decoded',
+    ['endpoint']
+)
+CACHE_LOOKUPS = Counter(
+    'ground_data_cache_lookups_total',
+    'Lookups of data that is kept locally, labelled by whether the data was available',
+    ['endpoint', 'cache', 'result']
+)
+UPSTREAM_RESPONSES = Counter(
+    'ground_data_upstream_responses_total',
+    'Responses of the Iowa server by status code',
+    ['endpoint', 'upstream', 'status']
+)
+
+@contextmanager
+def observe_phase(phase:str, **attributes) -> Iterator[None]:
+    '''
+    Measures the duration of the enclosed block as a phase of the current endpoint.
+    The phase is also recorded as span, if the request is traced.
+
+    Parameters
+    ----------
+    phase: `str`
+        The name of the phase
+    attributes:
+        Additional information for the span
+    '''
+    time_start = time.perf_counter()
+    try:
+        with span(phase, **attributes):
+            yield
+    finally:
+        PHASE_SECONDS.labels(endpoint=current_endpoint.get(), phase=phase).observe(time.perf_counter() - time_start)
+
+def count_rows(stage:str, rows:int):
+    ROWS.labels(endpoint=current_endpoint.get(), stage=stage).inc(rows)
+
+def count_parse_failures(failures:int):
+    METAR_PARSE_FAILURES.labels(endpoint=current_endpoint.get()).inc(failures)
+
+def count_cache_lookups(cache:str, hits:int, misses:int = 0):
+    CACHE_LOOKUPS.labels(endpoint=current_endpoint.get(), cache=cache, result='hit').inc(hits)
+    CACHE_LOOKUPS.labels(endpoint=current_endpoint.get(), cache=cache, result='miss').inc(misses)
+
+def count_upstream_response(upstream:str, status:int):
+    UPSTREAM_RESPONSES.labels(endpoint=current_endpoint.get(), upstream=upstream, status=str(status)).inc()
@@ -0,0 +1,142 @@
+'''
+Moves an existing, unpartitioned METAR data table into the monthly partitioned layout on PostgreSQL.
+
+The table of the configured layout is used, i.e. `metar_data` or `metar_data_compact`.
+It is renamed with the suffix `_legacy`, the partitioned table is created in its place
+and the rows are copied over in batches, each committed on its own. Running the command again after
+an interruption resumes the copy, because rows that already exist are skipped.
+
+Usage:
+```
+python -m ground_data_service.migrate [--batch-days 7] [--drop-legacy] [--explain]
+```
+'''
+import argparse
+import logging
+from datetime import datetime, timedelta
+
+import sqlalchemy as db
+import yaml
+
+from . import CompactMetarData, DatabaseConfig, MetarData, MetarPartitioner, prepare_schema
+
+
+class PartitionMigration:
+
+    def __init__(self, batch_days:int) -> None:
+        self.logger = logging.getLogger(f'{__name__}.{self.__class__.__name__}')
+        config = yaml.safe_load(open('config.yml'))
+        self.db_config = DatabaseConfig(config['database'])
+        self.db_config.partitioning = 'monthly'
+        self.db_engine = self.db_config.createDatabase()
+        self.batch_days = batch_days
+        self.table: db.Table = (CompactMetarData if self.db_config.layout == 'compact' else MetarData).__table__
+        self.legacy_table_name = f'{self.table.name}_legacy'
+        if self.db_engine.dialect.name != 'postgresql':
+            raise ValueError(f'Partitioning is only supported on PostgreSQL, not on {self.db_engine.dialect.name}')
+
+    def run(self, drop_legacy:bool):
+        partitioner = MetarPartitioner(self.db_engine, self.table.name)
+        inspector = db.inspect(self.db_engine)
+        if inspector.has_table(self.table.name) and not partitioner.is_partitioned():
+            self.__rename_legacy_table()
+        elif not inspector.has_table(self.legacy_table_name):
+            self.logger.info('Nothing to migrate, the table is already partitioned')
+            return
+        partitioner = prepare_schema(self.db_engine, self.db_config)
+        assert partitioner is not None, 'Partitioned table could not be created'
+        self.__copy_rows(partitioner)
+        if drop_legacy:
+            self.logger.info(f'Dropping {self.legacy_table_name}..')
+            with self.db_engine.begin() as connection:
+                connection.execute(db.text(f'DROP TABLE {self.legacy_table_name}'))
+        with self.db_engine.begin() as connection:
+            connection.execute(db.text(f'ANALYZE {self.table.name}'))
+        self.logger.info('Migration complete!')
+
+    def explain(self):
+        '''
+        Logs the plan of a typical range query, which lists only the partitions that are actually scanned.
+        '''
+        with self.db_engine.connect() as connection:
+            latest = connection.execute(db.select(db.func.max(self.table.c.datetime))).scalar()
+            if latest is None:
+                self.logger.info('Table is empty, nothing to explain')
+                return
+            stmt = (
+                db.select(self.table)
+                .where(self.table.c.datetime >= latest - timedelta(days=7))
+                .where(self.table.c.datetime < latest)
+            )
+            compiled = stmt.compile(self.db_engine, compile_kwargs={'literal_binds': True})
+            plan = connection.execute(db.text(f'EXPLAIN {compiled}')).scalars().all()
+        self.logger.info('Plan of a query over the last week of data:\n' + '\n'.join(plan))
+
+    def __rename_legacy_table(self):
+        self.logger.info(f'Renaming {self.table.name} to {self.legacy_table_name}..')
+        with self.db_engine.begin() as connection:
+            connection.execute(db.text(f'ALTER TABLE {self.table.name} RENAME TO {self.legacy_table_name}'))
+            # Constraint and index names are unique per schema - free them for the partitioned table
+            constraint_names = connection.execute(
+                db.text('SELECT conname FROM pg_constraint WHERE conrelid = CAST(:table_name AS regclass)'),
+                {'table_name': self.legacy_table_name}
+            ).scalars().all()
+            for constraint_name in filter(lambda x: x.startswith(self.table.name), constraint_names):
+                legacy_constraint_name = self.legacy_table_name + constraint_name[len(self.table.name):]
+                connection.execute(db.text(
+                    f'ALTER TABLE {self.legacy_table_name} RENAME CONSTRAINT {constraint_name} TO {legacy_constraint_name}'))
+            # Indexes of constraints have been renamed together with them - rename the remaining ones the same way
+            index_names = connection.execute(
+                db.text('SELECT indexname FROM pg_indexes WHERE tablename = :table_name AND schemaname = current_schema()'),
+                {'table_name': self.legacy_table_name}
+            ).scalars().all()
+            for index_name in filter(lambda x: self.table.name in x and self.legacy_table_name not in x, index_names):
+                legacy_index_name = index_name.replace(self.table.name, self.legacy_table_name, 1)
+                connection.execute(db.text(f'ALTER INDEX {index_name} RENAME TO {legacy_index_name}'))
+
+    def __copy_rows(self, partitioner:MetarPartitioner):
+        with self.db_engine.connect() as connection:
+            datetime_min, datetime_max = connection.execute(db.text(
+                f'SELECT min(datetime), max(datetime) FROM {self.legacy_table_name}')).one()
+        if datetime_min is None:
+            self.logger.info(f'{self.legacy_table_name} is empty, nothing to copy')
+            return
+        partitioner.ensure_partitions(datetime_min, datetime_max)
+        # Without an index on datetime, every batch would scan the whole legacy table
+        self.logger.info(f'Ensuring {self.legacy_table_name} has an index on datetime..')
+        with self.db_engine.begin() as connection:
+            connection.execute(db.text(
+                f'CREATE INDEX IF NOT EXISTS ix_{self.legacy_table_name}_datetime_brin '
+                f'ON {self.legacy_table_name} USING brin (datetime)'
+            ))
+        batch_start = datetime(datetime_min.year, datetime_min.month, datetime_min.day)
+        # The legacy table may predate some columns, which stay empty in the partitioned table
+        legacy_columns = [column['name'] for column in db.inspect(self.db_engine).get_columns(self.legacy_table_name)]
+        columns = ', '.join(filter(lambda x: x in legacy_columns, self.table.c.keys()))
+        stmt = db.text(
+            f'INSERT INTO {self.table.name} ({columns}) '
+            f'SELECT {columns} FROM {self.legacy_table_name} '
+            'WHERE datetime >= :batch_start AND datetime < :batch_end '
+            'ON CONFLICT DO NOTHING'
+        )
+        rows_total = 0
+        while batch_start <= datetime_max:
+            batch_end = batch_start + timedelta(days=self.batch_days)
+            with self.db_engine.begin() as connection:
+                rows = connection.execute(stmt, {'batch_start': batch_start, 'batch_end': batch_end}).rowcount
+            rows_total += rows
+            self.logger.info(f'Copied {rows} rows from {batch_start} until {batch_end} ({rows_total} in total)')
+            batch_start = batch_end
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Moves the METAR data into the monthly partitioned layout')
+    parser.add_argument('--batch-days', type=int, default=7, help='number of days copied per transaction')
+    parser.add_argument('--drop-legacy', action='store_true', help='drop the legacy table after copying')
+    parser.add_argument('--explain', action='store_true', help='only show the plan of a typical range query')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    migration = PartitionMigration(args.batch_days)
+    if args.explain:
+        migration.explain()
+    else:
+        migration.run(args.drop_legacy)
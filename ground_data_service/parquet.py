@@ -0,0 +1,349 @@
+import logging
+import os
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+from . import MetarStore, iterate_months
+
+HIVE_TYPES = "{'station': 'VARCHAR', 'month': 'VARCHAR'}"
+'''
+Types of the partition keys in the directory names, so station IDs like `0001` are not read as numbers
+'''
+
+INGEST_TIME_FORMAT = '%Y%m%dT%H%M%S%f'
+'''
+Format of the ingest times in the names of the ingest log `_ingest_log/<YYYY-MM-DD>/<ingest time>_<uuid>.csv`
+'''
+
+class ParquetMetarStore(MetarStore):
+    '''
+    Stores METAR data in local Parquet files, which are queried with DuckDB and need no database server.
+
+    The files are partitioned by station and month as `station=<station>/month=<YYYY-MM>/`,
+    so queries only open the files of the requested stations and months.
+    Every call of `store_data` adds one file to each partition it touches.
+    Partitions with many files are compacted into a single file when data is stored in them.
+    Ingests in progress are registered as files in the `_ingests` directory, which is shared by all processes.
+    Finished ingests are logged with the partitions they touched in the `_ingest_log` directory per day,
+    so the change feed only reads the partitions of new ingests instead of listing all partitions.
+    '''
+    compaction_threshold = 16
+    '''
+    Number of files in a partition, from which on the partition is compacted
+    '''
+    read_attempts = 3
+    '''
+    Number of attempts to read files, which may be removed by a concurrent compaction after they have been listed
+    '''
+
+    def __init__(self, data_path:str) -> None:
+        '''
+        Parameters
+        ----------
+        data_path: `str`
+            The directory of the Parquet files
+
+        Raises
+        ------
+        `ImportError`
+            If DuckDB is not installed
+        '''
+        if duckdb is None:
+            raise ImportError('The Parquet storage backend requires DuckDB - install it with "pip install duckdb"')
+        self.logger = logging.getLogger(f'{__name__}.{self.__class__.__name__}')
+        self.data_path = data_path
+        self.connection = duckdb.connect()
+
+    def get_partition_path(self, station:str, month_start:date) -> str:
+        return os.path.join(self.data_path, f'station={station}', f'month={month_start:%Y-%m}')
+
+    def get_partition_paths(self, stations:Optional[List[str]] = None, date_from:Optional[date] = None,
+            date_to:Optional[date] = None) -> List[str]:
+        '''
+        Lists all existing partitions of the stations in the half-open range `[date_from, date_to)`.
+        Without stations or range, the partitions of all stations or months are listed.
+        '''
+        if stations is None:
+            if not os.path.isdir(self.data_path):
+                return []
+            stations = [directory[len('station='):] for directory in os.listdir(self.data_path)
+                if directory.startswith('station=')]
+        if date_from is None or date_to is None:
+            station_paths = [os.path.join(self.data_path, f'station={station}') for station in stations]
+            return [os.path.join(path, directory) for path in station_paths if os.path.isdir(path)
+                for directory in os.listdir(path) if directory.startswith('month=')]
+        # The range is half-open, but iterate_months covers a closed range
+        last_day = pd.Timestamp(date_to) - pd.Timedelta(microseconds=1)
+        months = [month_start for month_start, _ in iterate_months(pd.Timestamp(date_from).date(), last_day.date())]
+        partition_paths = [self.get_partition_path(station, month_start) for station in stations for month_start in months]
+        return [path for path in partition_paths if os.path.isdir(path)]
+
+    def get_files(self, stations:Optional[List[str]] = None, date_from:Optional[date] = None,
+            date_to:Optional[date] = None) -> List[str]:
+        '''
+        Lists the file patterns of the partitions, which are selected like in `get_partition_paths`.
+        '''
+        return [os.path.join(path, '*.parquet') for path in self.get_partition_paths(stations, date_from, date_to)]
+
+    def get_ingest_log_path(self, day:Optional[date] = None) -> str:
+        if day is None:
+            return os.path.join(self.data_path, '_ingest_log')
+        return os.path.join(self.data_path, '_ingest_log', f'{day:%Y-%m-%d}')
+
+    def log_ingest(self, data:pd.DataFrame, ingested_at:datetime):
+        '''
+        Logs the partitions that an ingest has written to, together with the number of rows per partition.
+        '''
+        os.makedirs(self.get_ingest_log_path(ingested_at.date()), exist_ok=True)
+        try:
+            # Ingests from before this time, that have been stored without log, are found by listing all partitions
+            with open(os.path.join(self.get_ingest_log_path(), 'started.txt'), 'x') as file:
+                file.write(ingested_at.isoformat())
+        except FileExistsError:
+            pass
+        partitions = data.groupby([data['station'], data['datetime'].dt.strftime('%Y-%m')]).size()
+        path = os.path.join(self.get_ingest_log_path(ingested_at.date()),
+            f'{ingested_at:{INGEST_TIME_FORMAT}}_{uuid.uuid4().hex}.csv')
+        # Written under a temporary name, so readers never see an incomplete log
+        with open(path + '.tmp', 'w') as file:
+            file.writelines(f'{station},{month},{rows}\n' for (station, month), rows in partitions.items())
+        os.replace(path + '.tmp', path)
+
+    def get_logged_partitions(self, since:Optional[datetime], until:datetime,
+            stations:Optional[List[str]] = None) -> Optional[List[str]]:
+        '''
+        Lists the partitions that have been written to by ingests in the time-range `(since, until]`.
+
+        Returns
+        -------
+        `Optional[List[str]]`
+            The paths of the partitions, or None if some of the ingests may have been stored without log
+        '''
+        if since is None:
+            return None
+        try:
+            with open(os.path.join(self.get_ingest_log_path(), 'started.txt')) as file:
+                if since < datetime.fromisoformat(file.read()):
+                    return None
+        except FileNotFoundError:
+            return None
+        partitions = set()
+        day = since.date()
+        while day <= until.date():
+            day_path = self.get_ingest_log_path(day)
+            day += timedelta(days=1)
+            if not os.path.isdir(day_path):
+                continue
+            for file_name in os.listdir(day_path):
+                if not file_name.endswith('.csv'):
+                    continue
+                ingested_at = datetime.strptime(file_name.split('_')[0], INGEST_TIME_FORMAT)
+                if ingested_at <= since or ingested_at > until:
+                    continue
+                with open(os.path.join(day_path, file_name)) as file:
+                    for line in file.read().splitlines():
+                        station, month, _ = line.split(',')
+                        if stations is None or station in stations:
+                            partitions.add((station, month))
+        partition_paths = [os.path.join(self.data_path, f'station={station}', f'month={month}')
+            for station, month in sorted(partitions)]
+        return [path for path in partition_paths if os.path.isdir(path)]
+
+    def list_files(self, partition_path:str) -> List[str]:
+        return sorted(os.path.join(partition_path, file_name) for file_name in os.listdir(partition_path)
+            if file_name.endswith('.parquet'))
+
+    def read(self, get_files:Callable[[], List[str]], query:str, parameters:dict) -> Optional[pd.DataFrame]:
+        '''
+        Runs a query over the files listed by `get_files`, which are passed to it as the parameter `files`.
+
+        A compaction may remove files after they have been listed and before DuckDB opens them,
+        then the files are listed again and the query is repeated.
+
+        Returns
+        -------
+        `Optional[DataFrame]`
+            The result of the query, or None if there are no files
+        '''
+        for attempt in range(ParquetMetarStore.read_attempts):
+            files = get_files()
+            if len(files) == 0:
+                return None
+            try:
+                return self.connection.execute(query, {**parameters, 'files': files}).df()
+            except duckdb.IOException:
+                if attempt == ParquetMetarStore.read_attempts - 1:
+                    raise
+                self.logger.info('Files have been removed while reading them, reading again..')
+
+    @contextmanager
+    def track_ingest(self, ingested_at:datetime) -> Iterator[None]:
+        '''
+        Registers an ingest for the duration of the context, which has to contain the writing of its files.
+        '''
+        ingest_path = os.path.join(self.data_path, '_ingests')
+        os.makedirs(ingest_path, exist_ok=True)
+        path = os.path.join(ingest_path, f'{uuid.uuid4().hex}.txt')
+        with open(path, 'w') as file:
+            file.write(ingested_at.isoformat())
+        try:
+            yield
+        finally:
+            os.remove(path)
+
+    def store_data(self, data:pd.DataFrame, ingested_at:datetime):
+        if data.empty:
+            return
+        with self.track_ingest(ingested_at):
+            self.write_data(data, ingested_at)
+            self.log_ingest(data, ingested_at)
+        self.logger.info(f'Stored {len(data)} rows in Parquet files')
+        partitions = data[['station']].assign(month_start=data['datetime'].dt.to_period('M').dt.start_time).drop_duplicates()
+        for station, month_start in zip(partitions['station'], partitions['month_start']):
+            partition_path = self.get_partition_path(station, month_start)
+            if len(self.list_files(partition_path)) >= self.compaction_threshold:
+                self.compact_partition(partition_path)
+
+    def write_data(self, data:pd.DataFrame, ingested_at:datetime):
+        self.connection.register('metar_data', data[['station', 'datetime', 'metar']])
+        data_path = self.data_path.replace("'", "''")
+        try:
+            # Casts are required for chunks without any report, where pandas does not know the type of the METAR column
+            self.connection.execute(f'''
+                COPY (
+                    SELECT station, strftime(datetime, '%Y-%m') AS month, CAST(datetime AS TIMESTAMP) AS datetime,
+                        CAST(metar AS VARCHAR) AS metar, CAST($ingested_at AS TIMESTAMP) AS ingested_at
+                    FROM metar_data
+                ) TO '{data_path}' (
+                    FORMAT parquet, PARTITION_BY (station, month), FILENAME_PATTERN 'data_{{uuid}}', APPEND, COMPRESSION zstd
+                )
+            ''', {'ingested_at': ingested_at})
+        finally:
+            self.connection.unregister('metar_data')
+
+    def compact_partition(self, partition_path:str):
+        '''
+        Rewrites all files of a partition into a single file, which also removes duplicate reports.
+
+        The new file is written before the old ones are deleted, so no report is missing at any time,
+        and duplicates are removed while reading. Readers that have listed the old files before they are deleted
+        read again, see `read`.
+        '''
+        files = self.list_files(partition_path)
+        if len(files) < 2:
+            return
+        self.logger.info(f'Compacting {len(files)} files of partition {partition_path}..')
+        path = os.path.join(partition_path, f'data_{uuid.uuid4()}.parquet')
+        # Written under a temporary name, so readers never open an incomplete file
+        temporary_path = path.replace("'", "''") + '.tmp'
+        try:
+            self.connection.execute(f'''
+                COPY (
+                    SELECT DISTINCT ON (datetime) datetime, metar, ingested_at
+                    FROM read_parquet($files, hive_partitioning = false)
+                    ORDER BY datetime, ingested_at
+                ) TO '{temporary_path}' (FORMAT parquet, COMPRESSION zstd)
+            ''', {'files': files})
+        except duckdb.IOException:
+            self.logger.info(f'Partition {partition_path} has been compacted concurrently')
+            return
+        os.replace(path + '.tmp', path)
+        for file in files:
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                # The partition has been compacted concurrently
+                pass
+
+    def query_data(self, stations:List[str], datetime_from:datetime, datetime_to:datetime) -> pd.DataFrame:
+        # Without a primary key, duplicates from concurrent downloads of the same day are removed while reading
+        result = self.read(lambda: self.get_files(stations, datetime_from, datetime_to), f'''
+            SELECT DISTINCT ON (station, datetime) station, datetime, metar
+            FROM read_parquet($files, hive_partitioning = true, hive_types = {HIVE_TYPES})
+            WHERE datetime >= $datetime_from AND datetime < $datetime_to
+            ORDER BY station, datetime
+        ''', {'datetime_from': datetime_from, 'datetime_to': datetime_to})
+        if result is None:
+            return pd.DataFrame(columns=['station', 'datetime', 'metar'])
+        return result
+
+    def get_changed_files(self, since:Optional[datetime], until:datetime,
+            stations:Optional[List[str]] = None) -> List[str]:
+        '''
+        Lists the file patterns of the partitions that contain reports of the ingests in the time-range `(since, until]`.
+        '''
+        partition_paths = self.get_logged_partitions(since, until, stations)
+        if partition_paths is None:
+            partition_paths = self.get_partition_paths(stations)
+        return [os.path.join(path, '*.parquet') for path in partition_paths]
+
+    def query_changed_data(self, since:Optional[datetime], until:datetime,
+            stations:Optional[List[str]] = None) -> pd.DataFrame:
+        # All rows of the partitions are read, so reports that have been delivered by an earlier ingest
+        # are not delivered again, if they have been stored again by a concurrent download of the same day
+        result = self.read(lambda: self.get_changed_files(since, until, stations), f'''
+            SELECT * FROM (
+                SELECT DISTINCT ON (station, datetime) station, datetime, metar, ingested_at
+                FROM read_parquet($files, hive_partitioning = true, hive_types = {HIVE_TYPES})
+                WHERE metar IS NOT NULL AND ingested_at <= $until
+                ORDER BY station, datetime, ingested_at
+            )
+            WHERE $since IS NULL OR ingested_at > $since
+            ORDER BY ingested_at, station, datetime
+        ''', {'since': since, 'until': until})
+        if result is None:
+            return pd.DataFrame(columns=['station', 'datetime', 'metar', 'ingested_at'])
+        return result
+
+    def query_ingest_sizes(self, since:Optional[datetime], until:datetime,
+            stations:Optional[List[str]] = None) -> pd.DataFrame:
+        # Duplicates are counted as well, which is precise enough to size the pages of the change feed
+        result = self.read(lambda: self.get_changed_files(since, until, stations), f'''
+            SELECT ingested_at, count(*) AS rows
+            FROM read_parquet($files, hive_partitioning = true, hive_types = {HIVE_TYPES})
+            WHERE metar IS NOT NULL AND ingested_at <= $until
+                AND ($since IS NULL OR ingested_at > $since)
+            GROUP BY ingested_at
+            ORDER BY ingested_at
+        ''', {'since': since, 'until': until})
+        if result is None:
+            return pd.DataFrame(columns=['ingested_at', 'rows'])
+        return result
+
+    def query_dates(self, stations:List[str], date_from:date, date_to:date) -> Dict[str, np.ndarray[np.datetime64]]:
+        result: Dict[str, np.ndarray[np.datetime64]] = {station: np.array([], dtype='datetime64[D]') for station in stations}
+        dates = self.read(lambda: self.get_files(stations, date_from, date_to), f'''
+            SELECT DISTINCT station, CAST(datetime AS DATE) AS day
+            FROM read_parquet($files, hive_partitioning = true, hive_types = {HIVE_TYPES})
+            WHERE datetime >= $date_from AND datetime < $date_to
+        ''', {'date_from': date_from, 'date_to': date_to})
+        if dates is None:
+            return result
+        for station, station_days in dates.groupby('station')['day']:
+            result[station] = np.unique(station_days.values.astype('datetime64[D]'))
+        return result
+
+    def get_oldest_ingest(self, now:datetime) -> Optional[datetime]:
+        ingest_path = os.path.join(self.data_path, '_ingests')
+        if not os.path.isdir(ingest_path):
+            return None
+        started_at = []
+        for file_name in os.listdir(ingest_path):
+            try:
+                with open(os.path.join(ingest_path, file_name)) as file:
+                    started_at += [datetime.fromisoformat(file.read())]
+            except (FileNotFoundError, ValueError):
+                # The ingest has just finished or is still writing its start
+                continue
+        started_at = [value for value in started_at if value >= now - MetarStore.ingest_timeout]
+        return min(started_at) if len(started_at) > 0 else None
@@ -0,0 +1,256 @@
+import logging
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as db
+import sqlalchemy.orm as orm
+
+from . import MetarData, MetarIngest, MetarPartitioner
+
+
+class StorageConfig:
+
+    def __init__(self, config:dict) -> None:
+        self.backend    = config.get('backend', 'database')
+        self.data_path  = config.get('data-path', 'data/parquet/')
+
+class MetarStore(ABC):
+    '''
+    Storage backend of `MetarDataProvider`.
+
+    All backends accept and return data in the same format, so they are interchangeable for the rest of the service.
+    Data is always stored in whole days per station, and days without any report are stored as a single row without METAR,
+    so `query_dates` tells which days have already been downloaded.
+    Ingests are registered while they are in progress, so the change feed can hold back its watermark until they are done.
+    '''
+    ingest_timeout = timedelta(hours=1)
+    '''
+    Ingests that have been in progress for longer are considered abandoned, e.g. because their process has been killed
+    '''
+
+    @abstractmethod
+    def store_data(self, data:pd.DataFrame, ingested_at:datetime):
+        '''
+        Stores new reports, which must not have been stored before.
+
+        Parameters
+        ----------
+        data: `DataFrame`
+            The data with the columns `station`, `datetime` and `metar`, where `metar` is None for days without reports
+        ingested_at: `datetime`
+            The time of storage in UTC, which is recorded for the change feed
+        '''
+
+    @abstractmethod
+    def query_data(self, stations:List[str], datetime_from:datetime, datetime_to:datetime) -> pd.DataFrame:
+        '''
+        Queries the reports of the stations in the half-open time-range `[datetime_from, datetime_to)`.
+
+        Returns
+        -------
+        `DataFrame`
+            The data with the columns `station`, `datetime` and `metar`, ordered by station and datetime
+        '''
+
+    @abstractmethod
+    def query_changed_data(self, since:Optional[datetime], until:datetime,
+            stations:Optional[List[str]] = None) -> pd.DataFrame:
+        '''
+        Queries the reports that have been ingested in the time-range `(since, until]`.
+
+        Parameters
+        ----------
+        since: `Optional[datetime]`
+            The exclusive start of the ingest time-range, or None to include all data from before `until`
+        until: `datetime`
+            The inclusive end of the ingest time-range
+        stations: `Optional[List[str]]`
+            The stations to restrict the result to, or None for all stations
+
+        Returns
+        -------
+        `DataFrame`
+            The data with the columns `station`, `datetime`, `metar` and `ingested_at`, ordered by ingest time,
+            without the rows of days without reports
+        '''
+
+    @abstractmethod
+    def query_ingest_sizes(self, since:Optional[datetime], until:datetime,
+            stations:Optional[List[str]] = None) -> pd.DataFrame:
+        '''
+        Counts the reports per ingest in the time-range `(since, until]`, which are returned by `query_changed_data`.
+
+        Returns
+        -------
+        `DataFrame`
+            The columns `ingested_at` and `rows`, ordered by ingest time,
+            where the reports without ingest time come first, if `since` is None
+        '''
+
+    @abstractmethod
+    def query_dates(self, stations:List[str], date_from:date, date_to:date) -> Dict[str, np.ndarray[np.datetime64]]:
+        '''
+        Queries the days in the half-open range `[date_from, date_to)` that are stored per station.
+
+        Returns
+        -------
+        `Dict[str, np.ndarray[np.datetime64]]`
+            The sorted days per station, which is empty for stations without stored days
+        '''
+
+    @abstractmethod
+    def get_oldest_ingest(self, now:datetime) -> Optional[datetime]:
+        '''
+        Queries the start of the oldest ingest that is still in progress, which has not been abandoned.
+
+        Parameters
+        ----------
+        now: `datetime`
+            The current time in UTC
+
+        Returns
+        -------
+        `Optional[datetime]`
+            The ingest time of the oldest ingest in progress, or None if no ingest is in progress
+        '''
+
+class IngestLog:
+    '''
+    Registers the ingests in progress in the `metar_ingests` table, which is shared by all processes using the database.
+    '''
+
+    def __init__(self, engine:db.engine.Engine) -> None:
+        self.engine = engine
+
+    @contextmanager
+    def track(self, ingested_at:datetime) -> Iterator[None]:
+        '''
+        Registers an ingest for the duration of the context, which has to contain the commit of its rows.
+        '''
+        with self.engine.begin() as connection:
+            ingest_id = connection.execute(db.insert(MetarIngest).values(started_at=ingested_at)).inserted_primary_key[0]
+        try:
+            yield
+        finally:
+            with self.engine.begin() as connection:
+                connection.execute(db.delete(MetarIngest).where(MetarIngest.id == ingest_id))
+
+    def get_oldest(self, now:datetime) -> Optional[datetime]:
+        with self.engine.connect() as connection:
+            return connection.execute(
+                db.select(db.func.min(MetarIngest.started_at))
+                .where(MetarIngest.started_at >= now - MetarStore.ingest_timeout)
+            ).scalar()
+
+class DatabaseMetarStore(MetarStore):
+    '''
+    Stores METAR data in the `metar_data` table of the configured database, which is the default backend.
+    '''
+
+    def __init__(self, engine:db.engine.Engine, partitioner:Optional[MetarPartitioner] = None) -> None:
+        '''
+        Parameters
+        ----------
+        engine: `Engine`
+            The engine of the database, whose schema has already been created
+        partitioner: `Optional[MetarPartitioner]`
+            The partitioner of the table, if it is partitioned
+        '''
+        self.logger = logging.getLogger(f'{__name__}.{self.__class__.__name__}')
+        self.engine = engine
+        self.partitioner = partitioner
+        self.ingest_log = IngestLog(engine)
+
+    def store_data(self, data:pd.DataFrame, ingested_at:datetime):
+        if data.empty:
+            return
+        with self.ingest_log.track(ingested_at):
+            if self.partitioner is not None:
+                self.partitioner.ensure_partitions(data['datetime'].min(), data['datetime'].max())
+            # A single bulk insert keeps the transaction short, compared to adding ORM objects row by row
+            metar_data = [
+                {
+                    'station': station,
+                    'datetime': pd.Timestamp(obs_datetime).to_pydatetime(),
+                    'metar': None if pd.isna(metar) else metar,
+                    'ingested_at': ingested_at
+                }
+                for station, obs_datetime, metar in zip(data['station'], data['datetime'], data['metar'])
+            ]
+            self.logger.debug('Storing data: %s', metar_data)
+            with orm.Session(self.engine) as session:
+                session.execute(db.insert(MetarData), metar_data)
+                session.commit()
+        self.logger.info(f'Stored {len(metar_data)} rows in database')
+
+    def query_data(self, stations:List[str], datetime_from:datetime, datetime_to:datetime) -> pd.DataFrame:
+        metar_data = None
+        with orm.Session(self.engine) as session:
+            stmt = (
+                db.select(MetarData.station, MetarData.datetime, MetarData.metar)
+                .where(MetarData.station.in_(stations))
+                .where(MetarData.datetime >= datetime_from)
+                .where(MetarData.datetime < datetime_to)
+                .order_by(db.asc(MetarData.station), db.asc(MetarData.datetime))
+            )
+            metar_data: db.engine.result.ChunkedIteratorResult = session.execute(stmt)
+        # Format output
+        result = pd.DataFrame(metar_data.all(), columns=['station', 'datetime', 'metar'])
+        self.logger.debug('Result of query:\n%s', result)
+        return result
+
+    def query_changed_data(self, since:Optional[datetime], until:datetime,
+            stations:Optional[List[str]] = None) -> pd.DataFrame:
+        with orm.Session(self.engine) as session:
+            stmt = (
+                db.select(MetarData.station, MetarData.datetime, MetarData.metar, MetarData.ingested_at)
+                .where(MetarData.metar.is_not(None))
+                .order_by(db.asc(MetarData.ingested_at), db.asc(MetarData.station), db.asc(MetarData.datetime))
+            )
+            if since is None:
+                stmt = stmt.where(db.or_(MetarData.ingested_at.is_(None), MetarData.ingested_at <= until))
+            else:
+                stmt = stmt.where(MetarData.ingested_at > since).where(MetarData.ingested_at <= until)
+            if stations is not None:
+                stmt = stmt.where(MetarData.station.in_(stations))
+            return pd.DataFrame(session.execute(stmt).all(), columns=['station', 'datetime', 'metar', 'ingested_at'])
+
+    def query_ingest_sizes(self, since:Optional[datetime], until:datetime,
+            stations:Optional[List[str]] = None) -> pd.DataFrame:
+        with orm.Session(self.engine) as session:
+            stmt = (
+                db.select(MetarData.ingested_at, db.func.count())
+                .where(MetarData.metar.is_not(None))
+                .group_by(MetarData.ingested_at)
+                .order_by(MetarData.ingested_at.asc().nulls_first())
+            )
+            if since is None:
+                stmt = stmt.where(db.or_(MetarData.ingested_at.is_(None), MetarData.ingested_at <= until))
+            else:
+                stmt = stmt.where(MetarData.ingested_at > since).where(MetarData.ingested_at <= until)
+            if stations is not None:
+                stmt = stmt.where(MetarData.station.in_(stations))
+            return pd.DataFrame(session.execute(stmt).all(), columns=['ingested_at', 'rows'])
+
+    def query_dates(self, stations:List[str], date_from:date, date_to:date) -> Dict[str, np.ndarray[np.datetime64]]:
+        with orm.Session(self.engine) as session:
+            stmt = (
+                db.select(MetarData.station, MetarData.datetime)
+                .where(MetarData.station.in_(stations))
+                .where(MetarData.datetime >= date_from)
+                .where(MetarData.datetime < date_to)
+            )
+            dates = pd.DataFrame(session.execute(stmt).all(), columns=['station', 'datetime'])
+        # Format output
+        result: Dict[str, np.ndarray[np.datetime64]] = {station: np.array([], dtype='datetime64[D]') for station in stations}
+        for station, station_datetimes in dates.groupby('station')['datetime']:
+            result[station] = np.unique(station_datetimes.values.astype('datetime64[D]'))
+        self.logger.debug('Result of query:\n%s', result)
+        return result
+
+    def get_oldest_ingest(self, now:datetime) -> Optional[datetime]:
+        return self.ingest_log.get_oldest(now)
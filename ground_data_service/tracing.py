@@ -0,0 +1,176 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+
+
+class TracingConfig:
+
+    def __init__(self, config:dict) -> None:
+        self.enabled            = config.get('enabled', False)
+        self.profiling          = config.get('profiling', False)
+        self.trace_path         = config.get('trace-path', 'data/traces/')
+        self.max_traces         = config.get('max-traces', 100)
+        self.debug_sample_rate  = config.get('debug-sample-rate', 0.0)
+        self.profile_entries    = config.get('profile-entries', 30)
+
+class Trace:
+    '''
+    Timeline of the spans of a single request, which is only recorded for requests that opt in.
+    '''
+
+    def __init__(self, name:str, profile:bool = False) -> None:
+        '''
+        Parameters
+        ----------
+        name: `str`
+            The name of the traced request, usually its path
+        profile: `bool`
+            Whether the request is also profiled with cProfile
+        '''
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.started_at = datetime.now(timezone.utc)
+        self.time_start = time.perf_counter()
+        self.spans: List[dict] = []
+        self.depth = 0
+        self.profiler = cProfile.Profile() if profile else None
+        self.profile_summary: Optional[str] = None
+
+    @contextmanager
+    def profiling(self, entries:int = 30) -> Iterator[None]:
+        '''
+        Profiles the enclosed block if profiling was requested and keeps the most expensive functions as summary.
+
+        The profiler sees everything that runs on the thread, so concurrent requests may show up in the summary.
+        '''
+        if self.profiler is None:
+            yield
+            return
+        try:
+            self.profiler.enable()
+        except ValueError as error:
+            # Only one profiler can be active at a time
+            self.profile_summary = f'Profiling not possible: {error}'
+            yield
+            return
+        try:
+            yield
+        finally:
+            self.profiler.disable()
+            summary = io.StringIO()
+            pstats.Stats(self.profiler, stream=summary).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(entries)
+            self.profile_summary = summary.getvalue()
+
+    def get_durations(self) -> Dict[str, float]:
+        '''
+        Sums up the duration of all spans with the same name, in milliseconds.
+        '''
+        durations: Dict[str, float] = {}
+        for span_record in self.spans:
+            durations[span_record['name']] = durations.get(span_record['name'], 0.0) + span_record['duration_ms']
+        return durations
+
+    def get_server_timing(self) -> str:
+        '''
+        Formats the durations as value of the `Server-Timing` header, which browsers show next to the request.
+        '''
+        return ', '.join(f'{name};dur={duration:.3f}' for name, duration in self.get_durations().items())
+
+    def to_dict(self) -> dict:
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'started_at': self.started_at.isoformat(),
+            'spans': self.spans,
+            'durations_ms': self.get_durations(),
+            'profile': self.profile_summary
+        }
+
+    def write(self, directory:str, max_traces:int = 100) -> str:
+        '''
+        Writes the trace as JSON file named after its ID and removes the oldest traces beyond `max_traces`.
+
+        Returns
+        -------
+        `str`
+            The path of the written file
+        '''
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{self.trace_id}.json')
+        with open(path, 'w') as file:
+            json.dump(self.to_dict(), file, indent=4, default=str)
+        paths = [os.path.join(directory, file_name) for file_name in os.listdir(directory) if file_name.endswith('.json')]
+        if len(paths) > max_traces:
+            for old_path in sorted(paths, key=os.path.getmtime)[:len(paths) - max_traces]:
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    # Removed by a concurrent request
+                    pass
+        return path
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar('current_trace', default=None)
+'''
+The trace of the request that is currently being served, or None if it is not traced
+'''
+debug_sampled: ContextVar[bool] = ContextVar('debug_sampled', default=True)
+'''
+Whether debug messages are logged for the current request - outside of requests, all are logged
+'''
+
+@contextmanager
+def span(name:str, **attributes) -> Iterator[None]:
+    '''
+    Records the enclosed block as span of the current trace. Without a trace, nothing is recorded.
+
+    Parameters
+    ----------
+    name: `str`
+        The name of the span
+    attributes:
+        Additional information about the span, which has to be serializable as JSON
+    '''
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    time_start = time.perf_counter()
+    span_record = {
+        'name': name,
+        'depth': trace.depth,
+        'start_ms': 1000.0 * (time_start - trace.time_start),
+        'duration_ms': None,
+        'attributes': attributes
+    }
+    trace.spans += [span_record]
+    trace.depth += 1
+    try:
+        yield
+    finally:
+        trace.depth -= 1
+        span_record['duration_ms'] = 1000.0 * (time.perf_counter() - time_start)
+
+def sample_debug(rate:float) -> bool:
+    '''
+    Decides whether the debug messages of a request are logged, which is always the case for traced requests.
+    '''
+    return current_trace.get() is not None or random.random() < rate
+
+class DebugSampler(logging.Filter):
+    '''
+    Drops the debug messages of requests that have not been sampled.
+    Handlers apply filters before formatting, so the messages of dropped records are never rendered.
+    '''
+
+    def filter(self, record:logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or debug_sampled.get()
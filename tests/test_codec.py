@@ -0,0 +1,64 @@
+from datetime import date, datetime
+
+import pytest
+
+from benchmarks.synthetic import generate_corpus, generate_station_ids
+from ground_data_service import MetarCodec
+
+
+@pytest.fixture
+def codec() -> MetarCodec:
+    return MetarCodec()
+
+def test_round_trip_of_synthetic_corpus(codec:MetarCodec):
+    corpus = generate_corpus(generate_station_ids(20), date(2023, 1, 1), 2)
+    for station, obs_datetime, metar in zip(corpus['station'], corpus['datetime'], corpus['metar']):
+        assert codec.decode(station, obs_datetime, codec.encode(station, obs_datetime, metar)) == metar
+
+def test_prefix_is_stripped_if_report_matches_station(codec:MetarCodec):
+    metar = 'EDDF 011250Z 24010KT 9999 FEW030 10/05 Q1013 NOSIG'
+    payload = codec.encode('EDDF', datetime(2023, 1, 1, 12, 50), metar)
+    assert payload[0] & MetarCodec.FLAG_PREFIX_STRIPPED
+    assert not payload[0] & MetarCodec.FLAG_REPORT_ID
+    assert codec.decode('EDDF', datetime(2023, 1, 1, 12, 50), payload) == metar
+
+def test_report_naming_station_differently(codec:MetarCodec):
+    metar = 'KDSM 011254Z 18012G20KT 10SM FEW030 BKN250 10/05 A3002 RMK AO2 SLP170 T01000050'
+    payload = codec.encode('DSM', datetime(2023, 1, 1, 12, 54), metar)
+    assert payload[0] & MetarCodec.FLAG_PREFIX_STRIPPED
+    assert payload[0] & MetarCodec.FLAG_REPORT_ID
+    assert codec.decode('DSM', datetime(2023, 1, 1, 12, 54), payload) == metar
+
+@pytest.mark.parametrize('metar', [
+    # Time of the report differs from the time of the observation
+    'EDDF 011220Z 24010KT 9999 FEW030 10/05 Q1013 NOSIG',
+    # No station or time at the start
+    'METAR EDDF 011250Z 24010KT 9999 FEW030 10/05 Q1013',
+    'EDDF',
+    '',
+])
+def test_round_trip_without_matching_prefix(codec:MetarCodec, metar:str):
+    payload = codec.encode('EDDF', datetime(2023, 1, 1, 12, 50), metar)
+    assert not payload[0] & MetarCodec.FLAG_PREFIX_STRIPPED
+    assert codec.decode('EDDF', datetime(2023, 1, 1, 12, 50), payload) == metar
+
+@pytest.mark.parametrize('station, metar', [
+    ('EDDM', 'EDDM 011250Z 24010KT 9999 -SN FEW030 M02/M05 Q1013 RMK Schnee über München'),
+    ('EDDM', 'EDDМ 011250Z 24010KT 9999 FEW030 10/05 Q1013'),
+    ('RJTT', 'RJTT 011250Z 24010KT 9999 FEW030 10/05 Q1013 RMK 東京'),
+])
+def test_round_trip_of_non_ascii_text(codec:MetarCodec, station:str, metar:str):
+    payload = codec.encode(station, datetime(2023, 1, 1, 12, 50), metar)
+    assert codec.decode(station, datetime(2023, 1, 1, 12, 50), payload) == metar
+
+def test_missing_report(codec:MetarCodec):
+    assert codec.encode('EDDF', datetime(2023, 1, 1, 12, 50), None) is None
+    assert codec.encode('EDDF', datetime(2023, 1, 1, 12, 50), float('nan')) is None
+    assert codec.decode('EDDF', datetime(2023, 1, 1, 12, 50), None) is None
+
+def test_stored_payload_can_be_decoded(codec:MetarCodec):
+    # Payloads are stored permanently, so neither the format nor the dictionary may change
+    payload = bytes.fromhex(
+        '07044b44534d33b43030347237029905d60f728e31d82d46a60640217d035390610646c8c6189a038d313004b9c1d40000')
+    assert codec.decode('DSM', datetime(2023, 1, 1, 12, 54), payload) == \
+        'KDSM 011254Z 18012G20KT 10SM FEW030 BKN250 10/05 A3002 RMK AO2 SLP170 T01000050'
@@ -0,0 +1,57 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+import yaml
+
+from benchmarks.reconciliation import create_download, reconcile_per_station
+from ground_data_service import MetarDataProvider
+
+
+@pytest.fixture
+def provider(tmp_path, monkeypatch) -> MetarDataProvider:
+    config = {
+        'metar': {'download-url': 'http://localhost/cgi-bin/request/asos.py?', 'download-delay-seconds': 0.0},
+        'database': {'technology': 'sqlite', 'name': str(tmp_path / 'test.db'), 'username': '', 'password': '',
+            'host': '', 'port': 0}
+    }
+    (tmp_path / 'config.yml').write_text(yaml.safe_dump(config))
+    monkeypatch.chdir(tmp_path)
+    return MetarDataProvider()
+
+def normalize(data:pd.DataFrame) -> pd.DataFrame:
+    '''
+    Brings the results of both reconciliations into the same types and order.
+    '''
+    data = data[['station', 'datetime', 'metar']].copy()
+    data['datetime'] = pd.to_datetime(data['datetime']).astype('datetime64[ns]')
+    data['metar'] = data['metar'].astype(object).where(data['metar'].notna(), None)
+    return data.sort_values(['station', 'datetime'], ignore_index=True)
+
+def test_reconciliation_matches_per_station_loops(provider:MetarDataProvider):
+    stations = ['AAA', 'BBB', 'CCCC', 'DDDD']
+    days = np.datetime64(date(2023, 1, 1), 'D') + np.arange(6)
+    station_date_sets = {station: days[index % 2::2] for index, station in enumerate(stations)}
+    chunk_missing_data = {station: days[1 - index % 2::2] for index, station in enumerate(stations)}
+    # Every tenth station day has no reports
+    data = create_download(stations, days, 60, seed=0)
+    coverage = provider.get_station_day_index(station_date_sets)
+    missing = provider.get_station_day_index(chunk_missing_data)
+
+    result = provider.reconcile_download(data, coverage, missing)
+    expected = reconcile_per_station(data, station_date_sets, chunk_missing_data)
+    pd.testing.assert_frame_equal(normalize(result), normalize(expected))
+    assert result['metar'].isna().sum() > 0
+
+def test_reconciliation_of_empty_download(provider:MetarDataProvider):
+    days = np.datetime64(date(2023, 1, 1), 'D') + np.arange(3)
+    data = pd.DataFrame({'station': pd.Series([], dtype=object), 'datetime': pd.Series([], dtype='datetime64[ns]'),
+        'metar': pd.Series([], dtype=object)})
+    coverage = provider.get_station_day_index({'EDDF': days[:1]})
+    missing = provider.get_station_day_index({'EDDF': days[1:], 'ELLX': days})
+
+    result = provider.reconcile_download(data, coverage, missing)
+    expected = reconcile_per_station(data, {'EDDF': days[:1]}, {'EDDF': days[1:], 'ELLX': days})
+    pd.testing.assert_frame_equal(normalize(result), normalize(expected))
+    assert len(result) == 5 and result['metar'].isna().all()